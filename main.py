@@ -6,6 +6,13 @@ import plotly.graph_objects as go
 from datetime import date, datetime
 import warnings
 import io
+import os
+import json
+import hashlib
+import glob
+import shutil
+import threading
+import time
 
 warnings.filterwarnings('ignore')
 
@@ -201,112 +208,465 @@ st.markdown(professional_css, unsafe_allow_html=True)
 # FUNCIONES PRINCIPALES
 # =============================================================================
 
-@st.cache_data(persist="disk", show_spinner=False)
-def load_and_preprocess_data():
+# Directorio de datos: se usa el CSV más reciente que cumpla el patrón (la fecha va en el nombre)
+DATA_DIR = '.'
+DATA_FILE_PATTERN = 'all_countries_stocks_*.csv'
+# Segundos entre comprobaciones de un CSV nuevo en DATA_DIR
+DATASET_CHECK_INTERVAL = 60
+# Versión del preprocesado: subirla al cambiar el esquema, la limpieza o las métricas compuestas
+# para invalidar las instantáneas ya escritas
+PREPROCESSING_VERSION = 1
+# Huella del contenido: bloques muestreados a lo largo del archivo en lugar de leerlo entero
+FINGERPRINT_BLOCKS = 8
+FINGERPRINT_BLOCK_SIZE = 64 * 1024
+# Almacén columnar: un .npy por columna (más su tabla de textos si la tiene), este archivo de metadatos
+# y los conteos de no nulos por país y columna (para el cubo de cobertura sin leer todas las columnas)
+STORE_METADATA_FILE = 'metadata.json'
+STORE_COVERAGE_FILE = 'coverage.npy'
+
+# Magnitudes abreviadas (ej: 1.5B)
+SUFFIX_MULTIPLIERS = {'K': 1e3, 'M': 1e6, 'B': 1e9, 'T': 1e12}
+
+# Marcadores de dato ausente del CSV, además de los que pandas ya reconoce (N/A, n/a, vacío...)
+MISSING_VALUE_TOKENS = ['-', '--']
+
+# Esquema de columnas: tipo de cada columna del CSV
+# percent   -> número con posible signo % (ej: '12.5%')
+# ratio     -> número decimal sin unidad (ej: P/E, Beta)
+# money     -> magnitud con posible sufijo K/M/B/T (ej: '1.5B')
+# integer   -> conteos y años (se guardan como float para admitir NaN)
+# date      -> fechas
+# categorical -> texto de baja cardinalidad (país, sector...)
+# text      -> texto libre (símbolo, nombre)
+COLUMN_KINDS = {
+    'text': ['Symbol', 'Company Name'],
+    'categorical': [
+        'Country', 'Country_Original', 'Sector', 'Industry', 'Exchange', 'MC Group',
+        'In Index', 'Is SPAC', 'Options'
+    ],
+    'money': [
+        'Market Cap', 'Ent. Value', 'Employees', 'FCF', 'Revenue', 'Net Income', 'EBITDA',
+        'Total Cash', 'Total Debt', 'Volume', 'Avg. Volume', 'Dollar Vol.', 'Shares Out'
+    ],
+    'percent': [
+        'FCF Yield', 'Earnings Yield', 'Graham (%)', 'Lynch (%)', 'FCF / EV',
+        'ROE', 'ROA', 'ROIC', 'ROCE', 'ROE (5Y)', 'ROA (5Y)', 'ROIC (5Y)',
+        'Gross Margin', 'Oper. Margin', 'Pretax Margin', 'Profit Margin',
+        'FCF Margin', 'EBITDA Margin', 'EBIT Margin',
+        'Rev. Growth', 'Rev. Growth (Q)', 'Rev. Growth 3Y', 'Rev. Growth 5Y',
+        'EPS Growth', 'EPS Growth (Q)', 'EPS Growth 3Y', 'EPS Growth 5Y', 'FCF Growth',
+        'Rev Gr. This Y', 'Rev Gr. Next Y', 'EPS Gr. This Y', 'EPS Gr. Next Y',
+        'Rev Gr. This Q', 'Rev Gr. Next Q', 'EPS Gr. This Q', 'EPS Gr. Next Q',
+        'Div. Yield', 'Payout Ratio', 'Div. Growth', 'Div. Growth 3Y', 'Div. Growth 5Y',
+        'Div. Growth 10Y', 'Shareh. Yield', 'Buyback Yield',
+        'Return 1W', 'Return 1M', 'Return 3M', 'Return 6M', 'Return YTD',
+        'Return 1Y', 'Return 3Y', 'Return 5Y', 'Return 10Y',
+        '52W High Chg', '52W Low Chg', 'PT Upside',
+        'Shares Insiders', 'Shares Institut.', 'Short % Float', 'Short % Shares'
+    ],
+    'ratio': [
+        'PE Ratio', 'Forward PE', 'PB Ratio', 'PS Ratio', 'Forward PS', 'PEG Ratio',
+        'P/FCF', 'P/OCF', 'P/EBITDA', 'P/TBV', 'P/FFO',
+        'EV/Sales', 'EV/EBITDA', 'EV/EBIT', 'EV/FCF', 'EV/Earnings',
+        'Current Ratio', 'Quick Ratio', 'Debt / Equity', 'Debt / EBITDA', 'Debt / FCF',
+        'Int. Cov.', 'Z-Score', 'RSI', 'RSI (W)', 'RSI (M)', 'Beta (5Y)', 'ATR',
+        'Rel. Volume', 'Short Ratio', 'Rating'
+    ],
+    'integer': ['Years', 'F-Score', 'Founded', 'Analysts'],
+    'date': [
+        'IPO Date', 'Ex-Div Date', 'Payment Date', 'Earnings Date',
+        'Last Report Date', 'Next Earnings', 'Last Earnings', 'ATH Date', 'ATL Date',
+        'Last Stock Split', 'Last Split Date', '10K Date'
+    ]
+}
+COLUMN_SCHEMA = {col: kind for kind, cols in COLUMN_KINDS.items() for col in cols}
+# Huella del esquema: entra en la versión del dataset, así cada esquema tiene su propio almacén columnar
+SCHEMA_FINGERPRINT = hashlib.blake2b(json.dumps(COLUMN_KINDS, sort_keys=True).encode(), digest_size=4).hexdigest()
+
+# Tipos que se entregan al lector CSV: todo lo que necesita limpieza se lee como texto
+READER_DTYPES = {col: str for col, kind in COLUMN_SCHEMA.items() if kind not in ('ratio', 'integer')}
+
+# Modo de memoria compacta: categorías para texto de baja cardinalidad y float32 para métricas
+COMPACT_MEMORY = True
+# Un texto se convierte a 'category' si tiene menos valores distintos que esta fracción de filas
+CATEGORY_MAX_RATIO = 0.5
+# Por encima de este valor absoluto float32 pierde demasiada precisión para filtrar
+FLOAT32_MAX_ABS = 1e6
+SCORE_COLUMNS = ['Quality_Score', 'Value_Score', 'Growth_Score', 'Financial_Health_Score', 'Momentum_Score']
+
+def get_column_kind(col):
+    """Devuelve el tipo registrado de una columna, o lo deduce de su nombre si no está en el esquema"""
+    if col in COLUMN_SCHEMA:
+        return COLUMN_SCHEMA[col]
+    if col.endswith('Date'):
+        return 'date'
+    if '%' in col or any(keyword in col for keyword in ['Growth', 'Gr.', 'Return', 'Margin', 'Yield', 'Chg']):
+        return 'percent'
+    return None
+
+def find_latest_dataset(data_dir=DATA_DIR):
+    """Ruta del CSV más reciente del directorio de datos (por la fecha del nombre y, a igualdad, por mtime)"""
+    candidates = glob.glob(os.path.join(data_dir, DATA_FILE_PATTERN))
+    if not candidates:
+        return None
+    return max(candidates, key=lambda path: (os.path.basename(path), os.path.getmtime(path)))
+
+def fingerprint_file(path):
+    """
+    Huella rápida del contenido: tamaño, mtime y hash de bloques muestreados (inicio, final y
+    puntos intermedios), combinada con PREPROCESSING_VERSION y SCHEMA_FINGERPRINT
+    """
+    stat = os.stat(path)
+    digest = hashlib.blake2b(digest_size=8)
+    digest.update(f"{stat.st_size}:{stat.st_mtime_ns}:{PREPROCESSING_VERSION}:{SCHEMA_FINGERPRINT}".encode())
+    last_offset = max(stat.st_size - FINGERPRINT_BLOCK_SIZE, 0)
+    offsets = sorted({last_offset * i // max(FINGERPRINT_BLOCKS - 1, 1) for i in range(FINGERPRINT_BLOCKS)})
+    with open(path, 'rb') as f:
+        for offset in offsets:
+            f.seek(offset)
+            digest.update(f.read(FINGERPRINT_BLOCK_SIZE))
+    return digest.hexdigest()
+
+def get_store_path(path, fingerprint):
+    """Almacén columnar del DataFrame ya preprocesado, junto al CSV y con la huella en el nombre"""
+    return f"{os.path.splitext(path)[0]}.{fingerprint}.columns"
+
+def write_column_store(df, store_path):
+    """
+    Publica el DataFrame como un .npy por columna:
+    - numéricas y fechas -> el array tal cual
+    - category -> códigos enteros + tabla de categorías
+    - texto -> códigos de pd.factorize + tabla de valores distintos
+    Los metadatos guardan tipo y clase del esquema de cada columna.
+    Se escribe en un directorio temporal que se renombra al final; si otro proceso
+    ya publicó el mismo almacén se conserva el suyo
+    """
+    tmp_path = f"{store_path}.{os.getpid()}.tmp"
     try:
-        df = pd.read_csv('all_countries_stocks_20250919_122611.csv', low_memory=False)
-        
-        # Fill missing country values
+        os.makedirs(tmp_path)
+        columns = []
+        for i, col in enumerate(df.columns):
+            series = df[col]
+            entry = {'name': col, 'file': f"{i}.npy", 'dtype': str(series.dtype), 'schema': get_column_kind(col)}
+            table = None
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                entry['kind'] = 'category'
+                values, table = series.cat.codes.to_numpy(), series.cat.categories
+            elif isinstance(series.dtype, np.dtype) and series.dtype != object:
+                entry['kind'] = 'array'
+                values = series.to_numpy()
+            else:
+                entry['kind'] = 'text'
+                values, table = pd.factorize(series)
+                values = values.astype(np.int32)
+            np.save(os.path.join(tmp_path, entry['file']), values, allow_pickle=False)
+            if table is not None:
+                entry['table'] = f"{i}.table.npy"
+                np.save(os.path.join(tmp_path, entry['table']), np.asarray(table).astype(str), allow_pickle=False)
+            columns.append(entry)
+        metadata = {'rows': len(df), 'columns': columns}
         if 'Country' in df.columns:
-            df['Country'] = df['Country'].fillna('Unknown')
-            if 'Country_Original' in df.columns:
-                df.loc[df['Country'] == 'Unknown', 'Country'] = df.loc[df['Country'] == 'Unknown', 'Country_Original']
-        if 'Market Cap' in df.columns:
-            df['Market Cap'] = df['Market Cap'].fillna(0)
-            
-        # List of columns that should be numeric
-        numeric_columns = [
-            'PE Ratio', 'Forward PE', 'PB Ratio', 'PS Ratio', 'Forward PS', 'PEG Ratio',
-            'P/FCF', 'P/OCF', 'P/EBITDA', 'P/TBV', 'P/FFO',
-            'EV/Sales', 'EV/EBITDA', 'EV/EBIT', 'EV/FCF', 'EV/Earnings',
-            'FCF Yield', 'Earnings Yield', 'Graham (%)', 'Lynch (%)',
-            'ROE', 'ROA', 'ROIC', 'ROCE', 'ROE (5Y)', 'ROA (5Y)', 'ROIC (5Y)',
-            'Gross Margin', 'Oper. Margin', 'Pretax Margin', 'Profit Margin',
-            'FCF Margin', 'EBITDA Margin', 'EBIT Margin',
-            'Rev. Growth', 'Rev. Growth (Q)', 'Rev. Growth 3Y', 'Rev. Growth 5Y',
-            'EPS Growth', 'EPS Growth (Q)', 'EPS Growth 3Y', 'EPS Growth 5Y',
-            'Current Ratio', 'Quick Ratio', 'Debt / Equity', 'Debt / EBITDA',
-            'Z-Score', 'F-Score', 'FCF', 'Market Cap',
-            'Years', 'Div. Yield', 'Payout Ratio', 'Div. Growth',
-            'RSI', 'RSI (W)', 'RSI (M)', 'Beta (5Y)', 'ATR', 'Rel. Volume',
-            'Return 1W', 'Return 1M', 'Return 3M', 'Return 6M', 'Return YTD',
-            'Return 1Y', 'Return 3Y', 'Return 5Y', 'Return 10Y',
-            'Shares Insiders', 'Shares Institut.', 'Short % Float', 'Short Ratio',
-            '52W High Chg', '52W Low Chg', 'Employees', 'Founded', 'Analysts',
-            'Rev Gr. This Y', 'Rev Gr. Next Y', 'EPS Gr. This Y', 'EPS Gr. Next Y',
-            'Rev Gr. This Q', 'Rev Gr. Next Q', 'EPS Gr. This Q', 'EPS Gr. Next Q'
-        ]
-        
-        # Process columns that might contain percentage signs
-        for col in df.columns:
-            if df[col].dtype == 'object':
-                # Check if column contains percentage values
-                sample = df[col].dropna().head(100).astype(str)
-                if sample.str.contains('%', na=False).any():
-                    # Remove % and convert to float
-                    df[col] = df[col].astype(str).str.replace('%', '', regex=False)
-                    df[col] = pd.to_numeric(df[col], errors='coerce')
-        
-        # Convert all numeric columns to proper numeric type
-        for col in numeric_columns:
-            if col in df.columns:
-                # Handle special cases
-                if df[col].dtype == 'object':
-                    # Remove any non-numeric characters (except . and -)
-                    df[col] = df[col].astype(str).str.replace('[^0-9.-]', '', regex=True)
-                    # Replace empty strings with NaN
-                    df[col] = df[col].replace('', np.nan)
-                    df[col] = df[col].replace('-', np.nan)
-                    df[col] = df[col].replace('N/A', np.nan)
-                    df[col] = df[col].replace('n/a', np.nan)
-                
-                # Convert to numeric
-                df[col] = pd.to_numeric(df[col], errors='coerce')
-        
-        # Handle Market Cap specifically (might have K, M, B suffixes)
-        if 'Market Cap' in df.columns and df['Market Cap'].dtype == 'object':
-            def parse_market_cap_value(val):
-                if pd.isna(val) or val == '':
-                    return np.nan
-                val = str(val).upper().replace(',', '').strip()
-                multipliers = {'K': 1e3, 'M': 1e6, 'B': 1e9, 'T': 1e12}
-                for suffix, mult in multipliers.items():
-                    if val.endswith(suffix):
-                        try:
-                            return float(val[:-1]) * mult
-                        except:
-                            return np.nan
-                try:
-                    return float(val)
-                except:
-                    return np.nan
-            
-            df['Market Cap'] = df['Market Cap'].apply(parse_market_cap_value)
-        
-        # Process date columns
-        date_cols = ['IPO Date', 'Ex-Div Date', 'Payment Date', 'Earnings Date', 
-                     'Last Report Date', 'Next Earnings', 'Last Earnings', 'ATH Date', 'ATL Date',
-                     'Last Stock Split', 'Last Split Date', '10K Date']
-        for col in date_cols:
-            if col in df.columns:
-                df[col] = pd.to_datetime(df[col], errors='coerce')
-        
-        # Create composite metrics
-        df = create_composite_metrics(df)
-        
-        # Final validation: ensure critical numeric columns are numeric
-        critical_numeric = ['PE Ratio', 'PB Ratio', 'ROE', 'Market Cap', 'Rev. Growth', 'Return 1Y']
-        for col in critical_numeric:
-            if col in df.columns and df[col].dtype == 'object':
-                print(f"Warning: {col} still contains non-numeric values after processing")
-                df[col] = pd.to_numeric(df[col], errors='coerce')
-        
+            coverage = count_non_null_by_country(df)
+            np.save(os.path.join(tmp_path, STORE_COVERAGE_FILE), coverage.to_numpy(dtype=np.int64), allow_pickle=False)
+            metadata['coverage_countries'] = coverage.index.tolist()
+        with open(os.path.join(tmp_path, STORE_METADATA_FILE), 'w') as f:
+            json.dump(metadata, f)
+        os.rename(tmp_path, store_path)
+        return True
+    except Exception as e:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        if os.path.exists(os.path.join(store_path, STORE_METADATA_FILE)):
+            return True
+        print(f"Warning: no se pudo escribir el almacén columnar {store_path}: {e}")
+        return False
+
+def attach_column_store(store_path):
+    """
+    Abre el almacén con vistas NumPy de solo lectura sobre archivos mapeados en memoria (sin copia).
+    Abrirlo solo lee los metadatos: cada columna se pagina desde disco la primera vez que un filtro,
+    score, gráfico o la tabla la usa. Todos los procesos comparten las mismas páginas de la caché
+    del sistema operativo; solo las columnas de texto libre se materializan como objetos en cada proceso
+    """
+    metadata_path = os.path.join(store_path, STORE_METADATA_FILE)
+    if not os.path.exists(metadata_path):
+        return None
+    try:
+        with open(metadata_path) as f:
+            metadata = json.load(f)
+        stale = [entry['name'] for entry in metadata['columns'] if entry.get('schema') != get_column_kind(entry['name'])]
+        if stale:
+            # Se trata como un fallo de caché: no se borra, puede estar abierto por otro proceso
+            # con otra versión del código; los almacenes sobrantes los limpia evict_stores
+            print(f"Warning: el almacén {store_path} no coincide con el esquema actual ({', '.join(stale[:5])})")
+            return None
+        data = {}
+        for entry in metadata['columns']:
+            # np.asarray deja una vista ndarray normal sobre el mapa (sin copia)
+            values = np.asarray(np.load(os.path.join(store_path, entry['file']), mmap_mode='r'))
+            if entry['kind'] == 'array':
+                data[entry['name']] = values
+                continue
+            table = np.load(os.path.join(store_path, entry['table']), mmap_mode='r')
+            if entry['kind'] == 'category':
+                # Sin validar los códigos (los escribió write_column_store) para no leer la columna al abrir
+                data[entry['name']] = pd.Categorical.from_codes(values, categories=table, validate=False)
+            else:
+                text = np.full(len(values), np.nan, dtype=object)
+                valid = values >= 0
+                text[valid] = table.astype(object)[values[valid]]
+                data[entry['name']] = text
+        df = pd.DataFrame(data, index=pd.RangeIndex(metadata['rows']), copy=False)
+        df.attrs['store_path'] = store_path
         return df
-        
-    except FileNotFoundError:
-        st.error(f"❌ **Archivo no encontrado: all_countries_stocks_20250919_122611.csv**")
-        st.info("Por favor asegúrese de que el archivo CSV esté en el mismo directorio que esta aplicación.")
-        st.stop()
+    except Exception as e:
+        print(f"Warning: no se pudo abrir el almacén columnar {store_path}: {e}")
+        return None
+
+def read_store_coverage(store_path):
+    """Conteos de no nulos por país y columna guardados en el almacén, o None si no están"""
+    if not store_path or not os.path.exists(os.path.join(store_path, STORE_COVERAGE_FILE)):
+        return None
+    try:
+        with open(os.path.join(store_path, STORE_METADATA_FILE)) as f:
+            metadata = json.load(f)
+        counts = np.load(os.path.join(store_path, STORE_COVERAGE_FILE))
+        return pd.DataFrame(
+            counts, index=metadata['coverage_countries'], columns=[entry['name'] for entry in metadata['columns']]
+        )
+    except Exception as e:
+        print(f"Warning: no se pudo leer la cobertura del almacén {store_path}: {e}")
+        return None
+
+def evict_stores(data_dir, keep_path):
+    """Borra los almacenes de versiones anteriores (y las instantáneas Parquet antiguas) del directorio de datos"""
+    stem = os.path.join(data_dir, os.path.splitext(DATA_FILE_PATTERN)[0])
+    for stale_path in glob.glob(stem + '.columns') + glob.glob(stem + '.parquet'):
+        if os.path.abspath(stale_path) == os.path.abspath(keep_path):
+            continue
+        try:
+            if os.path.isdir(stale_path):
+                shutil.rmtree(stale_path)
+            else:
+                os.remove(stale_path)
+        except OSError as e:
+            print(f"Warning: no se pudo borrar {stale_path}: {e}")
+
+def build_dataset(path):
+    """
+    Construye el DataFrame preprocesado de un CSV (sin llamadas a Streamlit, apto para hilos):
+    1. Si existe el almacén columnar con la huella actual del CSV -> se abre mapeado en memoria
+    2. Si no -> se parsea el CSV, se preprocesa, se publica el almacén, se borran los antiguos
+       y se abre el recién escrito para compartir sus páginas en lugar de la copia privada
+    """
+    data_version = describe_dataset_version(path)
+    store_path = get_store_path(path, data_version.rsplit(':', 1)[1])
+    df = attach_column_store(store_path)
+    if df is None:
+        df = pd.read_csv(path, dtype=READER_DTYPES, na_values=MISSING_VALUE_TOKENS, low_memory=False)
+        df = preprocess_stock_data(df)
+        if COMPACT_MEMORY:
+            df = compact_dataframe(df)
+        if write_column_store(df, store_path):
+            evict_stores(os.path.dirname(path) or '.', store_path)
+            attached_df = attach_column_store(store_path)
+            if attached_df is not None:
+                df = attached_df
+    df.attrs['data_version'] = data_version
+    return df
+
+@st.cache_resource(show_spinner=False)
+def get_dataset_manager():
+    """Estado compartido por todas las sesiones: dataset vigente y recarga en curso"""
+    return {
+        'lock': threading.Lock(),
+        'current': None,     # DataFrame que reciben las sesiones al ejecutarse
+        'path': None,        # CSV del que procede
+        'building': None,    # CSV que se está construyendo en segundo plano
+        'checked_at': 0.0,
+        'failed_version': None,  # versión cuya recarga falló: no se reintenta hasta que cambie su huella
+        'error': None            # mensaje del último fallo, visible en la app
+    }
+
+def load_and_preprocess_data():
+    """
+    Devuelve el dataset vigente. Solo el primer arranque bloquea: una sesión lo construye
+    y las demás esperan al mismo resultado; las recargas posteriores van en segundo plano
+    """
+    manager = get_dataset_manager()
+    if manager['current'] is None:
+        with manager['lock']:
+            if manager['current'] is None:
+                path = find_latest_dataset()
+                if path is None:
+                    st.error(f"❌ **Archivo no encontrado: {os.path.join(DATA_DIR, DATA_FILE_PATTERN)}**")
+                    st.info("Por favor asegúrese de que el archivo CSV esté en el mismo directorio que esta aplicación.")
+                    st.stop()
+                manager['current'] = build_dataset(path)
+                manager['path'] = path
+                manager['checked_at'] = time.time()
+    # La sesión se queda con esta versión hasta su próxima ejecución
+    return manager['current']
+
+def refresh_dataset(index_builders=()):
+    """Si hay un CSV más nuevo que el vigente, lo construye en un hilo junto con sus índices"""
+    manager = get_dataset_manager()
+    with manager['lock']:
+        if manager['building'] or time.time() - manager['checked_at'] < DATASET_CHECK_INTERVAL:
+            return
+        manager['checked_at'] = time.time()
+        latest = find_latest_dataset()
+        if latest is None:
+            return
+        try:
+            version = describe_dataset_version(latest)
+        except OSError as e:
+            print(f"Warning: no se pudo leer el dataset {latest}: {e}")
+            return
+        if manager['current'] is not None and version == get_dataset_version(manager['current']):
+            manager['error'] = None
+            return
+        if version == manager['failed_version']:
+            return
+        manager['building'] = latest
+    threading.Thread(
+        target=build_dataset_in_background, args=(manager, latest, version, index_builders),
+        name='dataset-refresh', daemon=True
+    ).start()
+
+def build_dataset_in_background(manager, path, version, index_builders):
+    """
+    Construye el dataset y calienta sus índices fuera de las sesiones; después lo publica de una vez.
+    Si falla, se anota la versión para no volver a procesar el mismo archivo en cada comprobación
+    """
+    try:
+        df = build_dataset(path)
+        for builder in index_builders:
+            builder(get_dataset_version(df), df)
+        with manager['lock']:
+            manager['current'] = df
+            manager['path'] = path
+            manager['failed_version'] = None
+            manager['error'] = None
+    except Exception as e:
+        print(f"Warning: no se pudo recargar el dataset {path}: {e}")
+        with manager['lock']:
+            manager['failed_version'] = version
+            manager['error'] = f"{os.path.basename(path)}: {e}"
+    finally:
+        with manager['lock']:
+            manager['building'] = None
+
+def describe_dataset_version(path):
+    """Identificador de versión del dataset: nombre del archivo de origen y huella de su contenido"""
+    return f"{os.path.basename(path)}:{fingerprint_file(path)}"
+
+def get_dataset_version(df):
+    """Versión del dataset cargado, usada en las claves de las cachés derivadas"""
+    return df.attrs.get('data_version', 'desconocida')
+
+def to_arrow_compatible(df):
+    """Copia superficial apta para Arrow/Parquet: las columnas de texto mixtas se guardan como str"""
+    arrow_df = df.copy(deep=False)
+    # Arrow exige un tipo único por columna
+    for col in arrow_df.columns[arrow_df.dtypes == 'object']:
+        arrow_df[col] = arrow_df[col].where(arrow_df[col].isna(), arrow_df[col].astype(str))
+    return arrow_df
+
+def parse_suffixed_numbers(series):
+    """Convierte una columna completa con sufijos K/M/B/T a float sin llamadas Python por fila"""
+    if pd.api.types.is_numeric_dtype(series):
+        return series.astype(float)
+    text = series.astype(str).str.upper().str.replace(',', '', regex=False).str.strip()
+    multipliers = text.str[-1].map(SUFFIX_MULTIPLIERS)
+    has_suffix = multipliers.notna().to_numpy()
+    numbers = text.where(~has_suffix, text.str[:-1])
+    values = pd.to_numeric(numbers, errors='coerce').to_numpy(dtype=float)
+    return pd.Series(values * multipliers.fillna(1.0).to_numpy(dtype=float), index=series.index, name=series.name)
+
+def clean_numeric_text(series):
+    """Quita %, comas y cualquier carácter no numérico y convierte a float en una sola pasada"""
+    if pd.api.types.is_numeric_dtype(series):
+        return series.astype(float)
+    cleaned = series.astype(str).str.replace(r'[^0-9.\-]', '', regex=True)
+    return pd.to_numeric(cleaned, errors='coerce')
+
+def convert_columns(df):
+    """Convierte cada columna según su tipo en el esquema, con una sola pasada por columna"""
+    for col in df.columns:
+        kind = get_column_kind(col)
+        if kind in ('percent', 'ratio', 'integer'):
+            if not pd.api.types.is_numeric_dtype(df[col]):
+                df[col] = clean_numeric_text(df[col])
+        elif kind == 'money':
+            df[col] = parse_suffixed_numbers(df[col])
+        elif kind == 'date':
+            df[col] = pd.to_datetime(df[col], errors='coerce')
+    return df
+
+def compact_dataframe(df):
+    """
+    Reduce la memoria del DataFrame preprocesado:
+    - Texto de baja cardinalidad -> category
+    - Porcentajes, ratios y conteos -> float32 (las magnitudes monetarias quedan en float64)
+    - Scores parciales (0-100, enteros) -> uint8 y Master_Score -> float32
+    """
+    for col in df.columns:
+        series = df[col]
+        kind = get_column_kind(col)
+        if col in SCORE_COLUMNS:
+            df[col] = series.astype(np.uint8)
+        elif col == 'Master_Score':
+            df[col] = series.astype(np.float32)
+        elif series.dtype == 'object' or pd.api.types.is_string_dtype(series.dtype):
+            if kind == 'text':
+                continue
+            if kind == 'categorical' or series.nunique() < len(series) * CATEGORY_MAX_RATIO:
+                df[col] = series.astype('category')
+        elif series.dtype == np.float64 and kind != 'money':
+            if kind in ('percent', 'ratio', 'integer') or series.abs().max() < FLOAT32_MAX_ABS:
+                df[col] = series.astype(np.float32)
+    return df
+
+def build_memory_report(df):
+    """Compara por columna la memoria actual con la que ocuparía sin el modo compacto"""
+    rows = []
+    for col in df.columns:
+        series = df[col]
+        compact_bytes = series.memory_usage(deep=True, index=False)
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            original_bytes = series.astype(object).memory_usage(deep=True, index=False)
+        elif pd.api.types.is_numeric_dtype(series) and series.dtype.itemsize < 8:
+            original_bytes = len(series) * 8
+        else:
+            original_bytes = compact_bytes
+        rows.append({
+            'Columna': col,
+            'Tipo': str(series.dtype),
+            'Original (MB)': original_bytes / 1e6,
+            'Compacto (MB)': compact_bytes / 1e6,
+            'Ahorro (MB)': (original_bytes - compact_bytes) / 1e6,
+            'Ahorro (%)': (1 - compact_bytes / original_bytes) * 100 if original_bytes else 0.0
+        })
+    return pd.DataFrame(rows).sort_values('Ahorro (MB)', ascending=False)
+
+def preprocess_stock_data(df):
+    """Limpia y tipa el CSV crudo y añade las métricas compuestas"""
+    # Fill missing country values
+    if 'Country' in df.columns:
+        df['Country'] = df['Country'].fillna('Unknown')
+        if 'Country_Original' in df.columns:
+            df.loc[df['Country'] == 'Unknown', 'Country'] = df.loc[df['Country'] == 'Unknown', 'Country_Original']
+    
+    # Conversión de tipos guiada por el esquema
+    df = convert_columns(df)
+    
+    if 'Market Cap' in df.columns:
+        df['Market Cap'] = df['Market Cap'].fillna(0)
+    
+    # Create composite metrics
+    df = create_composite_metrics(df)
+    
+    return df
 
 def create_composite_metrics(df):
     # Score de Calidad
@@ -370,6 +730,190 @@ def create_composite_metrics(df):
                           df['Momentum_Score']*0.1)
     return df
 
+# Dimensiones categóricas con un bitmap precalculado por valor
+BITMAP_COLUMNS = ['Country', 'Sector', 'Industry', 'Exchange', 'MC Group']
+# Número de bits a 1 de cada byte, para contar filas directamente sobre bitmaps empaquetados
+BYTE_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def get_bitmap_index(data_version, _df):
+    """Construye una vez por versión del dataset un bitmap empaquetado (np.packbits) por valor de cada dimensión"""
+    columns = {}
+    for column in BITMAP_COLUMNS:
+        if column not in _df.columns:
+            continue
+        categorical = pd.Categorical(_df[column])
+        codes = categorical.codes
+        columns[column] = {
+            value: np.packbits(codes == code) for code, value in enumerate(categorical.categories)
+        }
+    return {'size': len(_df), 'columns': columns}
+
+def select_bitmap(bitmap_index, column, values):
+    """OR de los bitmaps de los valores seleccionados; los valores inexistentes no aportan filas"""
+    column_bitmaps = bitmap_index['columns'][column]
+    bitmaps = [column_bitmaps[value] for value in values if value in column_bitmaps]
+    if not bitmaps:
+        return np.zeros((bitmap_index['size'] + 7) // 8, dtype=np.uint8)
+    return np.bitwise_or.reduce(bitmaps)
+
+def bitmap_to_mask(bitmap_index, bitmap, rows=None):
+    """Convierte un bitmap empaquetado en máscara booleana (de todas las filas o solo de las posiciones rows)"""
+    if rows is None:
+        return np.unpackbits(bitmap, count=bitmap_index['size']).astype(bool)
+    return ((bitmap[rows >> 3] >> (7 - (rows & 7))) & 1).astype(bool)
+
+def count_bitmap(bitmap):
+    """Número de filas marcadas en un bitmap empaquetado"""
+    return int(BYTE_POPCOUNT[bitmap].sum(dtype=np.int64))
+
+def country_selection_mask(bitmap_index, countries, exclude=False):
+    """Máscara de las filas de los países seleccionados (o de todos los demás si exclude=True)"""
+    mask = bitmap_to_mask(bitmap_index, select_bitmap(bitmap_index, 'Country', countries))
+    return ~mask if exclude else mask
+
+def facet_counts(bitmap_index, column, selection_bitmap=None):
+    """Conteo de filas por valor de la dimensión (como value_counts), opcionalmente dentro de una selección"""
+    counts = {
+        value: count_bitmap(bitmap if selection_bitmap is None else bitmap & selection_bitmap)
+        for value, bitmap in bitmap_index['columns'][column].items()
+    }
+    counts = pd.Series(counts, dtype=np.int64).sort_values(ascending=False, kind='stable')
+    return counts[counts > 0]
+
+# Longitud de los n-gramas del índice de búsqueda y número de sugerencias mostradas al escribir
+SEARCH_NGRAM = 3
+SEARCH_SUGGESTIONS = 8
+
+def normalize_search_text(values):
+    """Minúsculas, sin acentos y con la puntuación convertida en espacios (vectorizado)"""
+    text = pd.Series(values, dtype=object).fillna('').astype(str)
+    return (text.str.normalize('NFKD').str.encode('ascii', 'ignore').str.decode('ascii')
+            .str.lower().str.replace(r'[^a-z0-9]+', ' ', regex=True).str.strip())
+
+def build_trigram_index(texts):
+    """Índice invertido trigrama -> posiciones (ordenadas y sin repetir) de los textos que lo contienen"""
+    postings = {}
+    for row, text in enumerate(texts):
+        for trigram in {text[i:i + SEARCH_NGRAM] for i in range(len(text) - SEARCH_NGRAM + 1)}:
+            postings.setdefault(trigram, []).append(row)
+    return {trigram: np.array(rows, dtype=np.int32) for trigram, rows in postings.items()}
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def get_search_index(data_version, _df):
+    """
+    Construye una vez por versión del dataset el índice de búsqueda:
+    símbolos exactos y ordenados (para prefijos) y trigramas de símbolos y nombres normalizados
+    """
+    symbols = (_df['Symbol'].astype(str).str.upper() if 'Symbol' in _df.columns
+               else pd.Series('', index=_df.index)).to_numpy(dtype=str)
+    names = (normalize_search_text(_df['Company Name']) if 'Company Name' in _df.columns
+             else pd.Series('', index=_df.index)).to_numpy(dtype=object)
+    symbol_order = np.argsort(symbols, kind='stable').astype(np.int32)
+    weight = (pd.to_numeric(_df['Market Cap'], errors='coerce').fillna(0).to_numpy(dtype=np.float64)
+              if 'Market Cap' in _df.columns else np.zeros(len(_df)))
+    return {
+        'size': len(_df),
+        'symbols': symbols,
+        'names': names,
+        'symbol_order': symbol_order,
+        'sorted_symbols': symbols[symbol_order],
+        'symbol_exact': pd.Series(np.arange(len(_df), dtype=np.int32)).groupby(symbols).indices,
+        'symbol_trigrams': build_trigram_index(symbols),
+        'name_trigrams': build_trigram_index(names),
+        'weight': weight,
+    }
+
+def substring_rows(trigram_index, texts, term):
+    """
+    Posiciones cuyo texto contiene term: intersección de las listas de sus trigramas
+    y verificación final del substring; los términos cortos recorren la columna
+    """
+    if len(term) < SEARCH_NGRAM:
+        return np.flatnonzero(pd.Series(texts, dtype=object).str.contains(term, regex=False).to_numpy())
+    postings = sorted(
+        (trigram_index.get(term[i:i + SEARCH_NGRAM], np.empty(0, dtype=np.int32))
+         for i in range(len(term) - SEARCH_NGRAM + 1)),
+        key=len
+    )
+    candidates = postings[0]
+    for ids in postings[1:]:
+        if len(candidates) == 0:
+            break
+        candidates = np.intersect1d(candidates, ids, assume_unique=True)
+    return candidates[np.array([term in texts[row] for row in candidates], dtype=bool)]
+
+def search_rows(search_index, term, limit=None):
+    """
+    Posiciones que coinciden con el término (símbolo o nombre), ordenadas por relevancia:
+    símbolo exacto, prefijo de símbolo, prefijo de nombre y resto; empates por capitalización
+    """
+    symbol_term = str(term).strip().upper()
+    name_term = normalize_search_text([term]).iloc[0]
+    symbols = search_index['sorted_symbols']
+    
+    rank = np.full(search_index['size'], 4, dtype=np.int8)
+    # Un término vacío tras normalizar (solo puntuación, ej: '.' en el nombre) no coincide con nada:
+    # str.contains('') daría todas las filas
+    if name_term:
+        name_rows = substring_rows(search_index['name_trigrams'], search_index['names'], name_term)
+        rank[name_rows] = 3
+        starts = np.array([search_index['names'][row].startswith(name_term) for row in name_rows], dtype=bool)
+        rank[name_rows[starts]] = 2
+    if symbol_term:
+        rank[substring_rows(search_index['symbol_trigrams'], search_index['symbols'], symbol_term)] = 3
+        start = np.searchsorted(symbols, symbol_term, side='left')
+        stop = np.searchsorted(symbols, symbol_term + '\U0010FFFF', side='right')
+        rank[search_index['symbol_order'][start:stop]] = 1
+        rank[search_index['symbol_exact'].get(symbol_term, [])] = 0
+    
+    matches = np.flatnonzero(rank < 4)
+    ranked = matches[np.lexsort((-search_index['weight'][matches], rank[matches]))]
+    return ranked if limit is None else ranked[:limit]
+
+# Categorías de métricas del explorador de cobertura (el cubo guarda además si hay alguna con dato)
+COVERAGE_GROUPS = {
+    "Valoración Fundamental": ['PE Ratio', 'PB Ratio', 'PS Ratio', 'PEG Ratio', 'EV/EBITDA'],
+    "Rentabilidad": ['ROE', 'ROA', 'ROIC', 'Profit Margin', 'Gross Margin'],
+    "Crecimiento": ['Rev. Growth', 'EPS Growth', 'Rev Gr. Next Y', 'EPS Gr. Next Y'],
+    "Salud Financiera": ['Current Ratio', 'Debt / Equity', 'Z-Score', 'FCF'],
+    "Dividendos": ['Div. Yield', 'Payout Ratio', 'Years', 'Div. Growth'],
+    "Técnico": ['RSI', 'Beta (5Y)', 'Return 1Y', 'Rel. Volume'],
+    "Estimaciones": ['Forward PE', 'Analysts', 'PT Upside', 'Rating']
+}
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def get_coverage_cube(data_version, _df):
+    """
+    Cubo país x columna con el número de valores no nulos, calculado una vez por versión
+    del dataset. Incluye '_rows' (filas por país) y 'any:<categoría>' (filas con alguna
+    métrica de la categoría). Los conteos por columna se leen del almacén columnar si están,
+    así que solo se recorren las columnas de COVERAGE_GROUPS
+    """
+    countries = _df['Country'].astype(str).to_numpy()
+    counts = read_store_coverage(_df.attrs.get('store_path'))
+    if counts is None:
+        counts = count_non_null_by_country(_df)
+    extra = {'_rows': np.ones(len(_df), dtype=bool)}
+    for group, metrics in COVERAGE_GROUPS.items():
+        available = [metric for metric in metrics if metric in _df.columns]
+        extra[f"any:{group}"] = _df[available].notna().any(axis=1).to_numpy() if available else np.zeros(len(_df), dtype=bool)
+    extra_counts = pd.DataFrame(extra, index=_df.index).groupby(countries).sum()
+    return pd.concat([counts, extra_counts], axis=1).astype(np.int64)
+
+def count_non_null_by_country(df):
+    """Número de valores no nulos de cada columna por país, con un único groupby sobre notna()"""
+    return df.notna().groupby(df['Country'].astype(str).to_numpy()).sum()
+
+def get_coverage(coverage_cube, countries=None, exclude=False):
+    """Cobertura (fracción de no nulos) por columna de una selección de países, sumando filas del cubo"""
+    if countries:
+        selected = coverage_cube.index.isin(countries)
+        totals = coverage_cube[~selected if exclude else selected].sum()
+    else:
+        totals = coverage_cube.sum()
+    return totals / totals['_rows'] if totals['_rows'] else totals * 0.0
+
 def format_number(num, prefix="", suffix="", decimals=2):
     if pd.isna(num): return "N/D"
     if abs(num) >= 1e12: return f"{prefix}{num/1e12:.{decimals}f}T{suffix}"
@@ -379,48 +923,115 @@ def format_number(num, prefix="", suffix="", decimals=2):
     else: return f"{prefix}{num:.{decimals}f}{suffix}"
 
 def parse_market_cap(value_str):
+    """Convierte strings de capitalización de mercado a números"""
     if not value_str or value_str == "": return None
-    value_str = value_str.upper().replace(',', '').strip()
-    multipliers = {'K': 1e3, 'M': 1e6, 'B': 1e9, 'T': 1e12}
-    for suffix, multiplier in multipliers.items():
-        if value_str.endswith(suffix):
-            try: return float(value_str[:-1]) * multiplier
-            except: return None
-    try: return float(value_str)
-    except: return None
-
-def render_ranking_card(title, emoji, df, score_col, metric_col, metric_label, metric_format, num_results=10):
-    st.markdown(f"#### {emoji} {title}")
-    
-    if score_col not in df.columns or df[score_col].empty:
-        st.caption(f"Sin datos para '{score_col}'.")
-        return
-        
-    sorted_df = df.nlargest(num_results, score_col)
-    
-    if sorted_df.empty:
-        st.caption("Sin resultados en esta categoría.")
-        return
+    value = parse_suffixed_numbers(pd.Series([value_str])).iloc[0]
+    return None if pd.isna(value) else float(value)
 
-    for _, row in sorted_df.iterrows():
-        score = row[score_col]
-        color = "#10b981" if score >= 75 else "#f59e0b" if score >= 50 else "#ef4444"
-        
-        metric_value = row.get(metric_col, 'N/D')
-        if pd.notna(metric_value) and isinstance(metric_value, (int, float)):
-             metric_display = metric_format.format(metric_value)
+def top_k_positions(series, k, ascending=False):
+    """
+    Posiciones de las k primeras filas según series, como sort_values(...).head(k):
+    NaN al final y empates en el orden original (keep='first'). Para columnas numéricas
+    usa selección parcial (np.partition) y solo ordena los candidatos
+    """
+    if not pd.api.types.is_numeric_dtype(series):
+        ordered = series.reset_index(drop=True).sort_values(ascending=ascending, kind='stable', na_position='last')
+        return ordered.index.to_numpy()[:k]
+    keys = series.to_numpy(dtype=np.float64, na_value=np.nan)
+    if not ascending:
+        keys = -keys
+    valid = np.flatnonzero(~np.isnan(keys))
+    if k < len(valid):
+        threshold = np.partition(keys[valid], k - 1)[k - 1]
+        valid = valid[keys[valid] <= threshold]
+    ranked = valid[np.argsort(keys[valid], kind='stable')][:k]
+    if len(ranked) < k:
+        ranked = np.concatenate([ranked, np.flatnonzero(np.isnan(keys))[:k - len(ranked)]])
+    return ranked
+
+def top_k(df, column, k, ascending=False):
+    """Las k primeras filas de df ordenadas por column (ver top_k_positions)"""
+    if k <= 0:
+        return df.iloc[:0]
+    return df.iloc[top_k_positions(df[column], k, ascending)]
+
+# Rankings de la pestaña "🏆 Rankings": los seis primeros se muestran por defecto
+RANKING_CARDS = [
+    {'title': "Top Valor", 'emoji': "💎", 'score_col': 'Value_Score',
+     'metric_col': 'PE Ratio', 'metric_label': 'P/E', 'metric_format': '%.1f'},
+    {'title': "Top Crecimiento", 'emoji': "🚀", 'score_col': 'Growth_Score',
+     'metric_col': 'Rev. Growth', 'metric_label': 'Crecimiento Ingresos', 'metric_format': '%.1f%%'},
+    {'title': "Top Calidad", 'emoji': "⭐", 'score_col': 'Quality_Score',
+     'metric_col': 'ROE', 'metric_label': 'ROE', 'metric_format': '%.1f%%'},
+    {'title': "Top Dividendos", 'emoji': "💰", 'score_col': 'Div. Yield', 'positive_only': True,
+     'metric_col': 'Payout Ratio', 'metric_label': 'Payout', 'metric_format': '%.1f%%'},
+    {'title': "Top Momentum", 'emoji': "📈", 'score_col': 'Momentum_Score',
+     'metric_col': 'Return 1Y', 'metric_label': 'Retorno 1A', 'metric_format': '%.1f%%'},
+    {'title': "Top Salud Financiera", 'emoji': "🏥", 'score_col': 'Financial_Health_Score',
+     'metric_col': 'Current Ratio', 'metric_label': 'Ratio Corriente', 'metric_format': '%.2f'},
+    {'title': "Top Score Maestro", 'emoji': "🏅", 'score_col': 'Master_Score',
+     'metric_col': 'Market Cap', 'metric_label': 'Cap.', 'metric_format': 'money'},
+    {'title': "Top FCF Yield", 'emoji': "💵", 'score_col': 'FCF Yield', 'positive_only': True,
+     'metric_col': 'P/FCF', 'metric_label': 'P/FCF', 'metric_format': '%.1f'},
+    {'title': "Top Potencial Analistas", 'emoji': "🎯", 'score_col': 'PT Upside', 'positive_only': True,
+     'metric_col': 'Analysts', 'metric_label': 'Analistas', 'metric_format': '%.0f'},
+]
+DEFAULT_RANKING_CARDS = [card['title'] for card in RANKING_CARDS[:6]]
+
+def build_ranking_card_html(card, df, num_results=10):
+    """
+    Tarjeta de ranking como un único bloque HTML: top-k por la columna de puntuación
+    y formato vectorizado de todas sus filas (un solo elemento para el navegador)
+    """
+    header = f"<h4>{card['emoji']} {card['title']}</h4>"
+    score_col = card['score_col']
+    if score_col not in df.columns or df[score_col].empty:
+        return f"<div class='ranking-card'>{header}<small>Sin datos para '{score_col}'.</small></div>"
+    if card.get('positive_only'):
+        df = df[(df[score_col] > 0).to_numpy()]
+    top = top_k(df, score_col, num_results)
+    top = top[top[score_col].notna()]
+    if top.empty:
+        return f"<div class='ranking-card'>{header}<small>Sin resultados en esta categoría.</small></div>"
+    
+    scores = top[score_col].to_numpy(dtype=np.float64)
+    color = np.select([scores >= 75, scores >= 50], ['#10b981', '#f59e0b'], default='#ef4444')
+    metric_col = card['metric_col']
+    if metric_col in top.columns and pd.api.types.is_numeric_dtype(top[metric_col]):
+        if card['metric_format'] == 'money':
+            metric = format_number_series(top[metric_col], prefix='$')
         else:
-             metric_display = "-"
-        
-        symbol = row['Symbol']
-        country = row.get('Country', '')
-        country_display = f" | {country}" if country else ""
-        
-        st.markdown(
-            f"<span style='color: {color}; font-weight: bold;'>{symbol}</span> - Puntuación: {score:.0f}{country_display}",
-            unsafe_allow_html=True
-        )
-        st.caption(f"{row['Company Name'][:35]} | {metric_label}: {metric_display}")
+            metric_values = top[metric_col].to_numpy(dtype=np.float64, na_value=np.nan)
+            metric = pd.Series(np.char.mod(card['metric_format'], metric_values), index=top.index)
+            metric = metric.where(~np.isnan(metric_values), '-')
+    else:
+        metric = pd.Series('-', index=top.index)
+    country = (' | ' + escape_html(top['Country'])) if 'Country' in top.columns else ''
+    name = (escape_html(top['Company Name'].astype(object).where(top['Company Name'].notna(), '').astype(str).str.slice(0, 35))
+            if 'Company Name' in top.columns else '')
+    
+    rows = ("<div class='ranking-row'><span style='color: " + pd.Series(color, index=top.index)
+            + "; font-weight: bold;'>" + escape_html(top['Symbol']) + "</span> - Puntuación: "
+            + np.char.mod('%.0f', scores) + country + "<br><small>" + name + " | "
+            + card['metric_label'] + ": " + metric + "</small></div>")
+    return f"<div class='ranking-card'>{header}{''.join(rows.tolist())}</div>"
+
+def render_ranking_cards(df, titles, num_results=10, n_columns=3):
+    """Rankings seleccionados repartidos en columnas, con un st.markdown por columna"""
+    cards = [card for card in RANKING_CARDS if card['title'] in titles]
+    st.markdown("""
+    <style>
+        .ranking-card { margin-bottom: 18px; }
+        .ranking-card h4 { margin-bottom: 8px; }
+        .ranking-row { margin-bottom: 8px; line-height: 1.4; }
+        .ranking-row small { color: rgba(250, 250, 250, 0.6); }
+    </style>
+    """, unsafe_allow_html=True)
+    for col, start in zip(st.columns(n_columns), range(n_columns)):
+        with col:
+            blocks = [build_ranking_card_html(card, df, num_results) for card in cards[start::n_columns]]
+            if blocks:
+                st.markdown("<hr>".join(blocks), unsafe_allow_html=True)
 
 
 # Función mejorada para la página de bienvenida
@@ -453,6 +1064,8 @@ def show_welcome_page():
     # Cargar datos para estadísticas
     with st.spinner("🔄 Cargando base de datos global..."):
         df_welcome = load_and_preprocess_data()
+        welcome_bitmaps = get_bitmap_index(get_dataset_version(df_welcome), df_welcome)
+        welcome_coverage = get_coverage_cube(get_dataset_version(df_welcome), df_welcome)
     
     # ============= SECCIÓN 1: ¿QUÉ PUEDES HACER? =============
     st.markdown("## 🎯 ¿Qué Puedes Hacer con Este Screener?")
@@ -513,7 +1126,7 @@ def show_welcome_page():
     st.markdown("## 🌐 Distribución Global de Acciones")
     
     # Preparar datos para el pie chart
-    country_counts = df_welcome['Country'].value_counts()
+    country_counts = facet_counts(welcome_bitmaps, 'Country')
     
     # Agrupar países por regiones para mejor visualización
     regions = {
@@ -743,7 +1356,7 @@ def show_welcome_page():
         )
         
         if selected_country:
-            country_df = df_welcome[df_welcome['Country'] == selected_country]
+            country_df = df_welcome[country_selection_mask(welcome_bitmaps, [selected_country])]
             
             # Métricas del país seleccionado
             st.metric("Total Acciones", f"{len(country_df):,}")
@@ -758,27 +1371,11 @@ def show_welcome_page():
             # Análisis de cobertura de datos
             st.markdown(f"### 📊 Cobertura de Datos: **{selected_country}**")
             
-            # Categorías de métricas a evaluar
-            metric_categories = {
-                "Valoración Fundamental": ['PE Ratio', 'PB Ratio', 'PS Ratio', 'PEG Ratio', 'EV/EBITDA'],
-                "Rentabilidad": ['ROE', 'ROA', 'ROIC', 'Profit Margin', 'Gross Margin'],
-                "Crecimiento": ['Rev. Growth', 'EPS Growth', 'Rev Gr. Next Y', 'EPS Gr. Next Y'],
-                "Salud Financiera": ['Current Ratio', 'Debt / Equity', 'Z-Score', 'FCF'],
-                "Dividendos": ['Div. Yield', 'Payout Ratio', 'Years', 'Div. Growth'],
-                "Técnico": ['RSI', 'Beta (5Y)', 'Return 1Y', 'Rel. Volume'],
-                "Estimaciones": ['Forward PE', 'Analysts', 'PT Upside', 'Rating']
-            }
-            
-            # Calcular cobertura para cada categoría
+            # Cobertura por categoría: % de empresas con alguna métrica de la categoría (del cubo de cobertura)
+            country_coverage = get_coverage(welcome_coverage, [selected_country])
             coverage_results = []
-            for category, metrics in metric_categories.items():
-                available_metrics = [m for m in metrics if m in country_df.columns]
-                if available_metrics:
-                    # Calcular porcentaje de empresas con datos en esta categoría
-                    has_data = country_df[available_metrics].notna().any(axis=1)
-                    coverage_pct = (has_data.sum() / len(country_df) * 100) if len(country_df) > 0 else 0
-                else:
-                    coverage_pct = 0
+            for category in COVERAGE_GROUPS:
+                coverage_pct = country_coverage[f"any:{category}"] * 100
                 
                 coverage_results.append({
                     'Categoría': category,
@@ -1603,22 +2200,33 @@ def mark_filters_as_modified():
     """Marca que los filtros han sido modificados manualmente"""
     st.session_state.manual_filters_modified = True
 
-def parse_market_cap(value_str):
-    """Convierte strings de capitalización de mercado a números"""
-    if not value_str or value_str == "":
-        return None
-    value_str = value_str.upper().replace(',', '').strip()
-    multipliers = {'K': 1e3, 'M': 1e6, 'B': 1e9, 'T': 1e12}
-    for suffix, multiplier in multipliers.items():
-        if value_str.endswith(suffix):
-            try:
-                return float(value_str[:-1]) * multiplier
-            except:
-                return None
-    try:
-        return float(value_str)
-    except:
-        return None
+@st.fragment
+def render_search_box(df, search_index):
+    """
+    Caja de búsqueda con sugerencias: al confirmar el texto (Enter o al salir del campo)
+    solo se re-ejecuta este fragmento, que consulta el índice de búsqueda en lugar de
+    recorrer las columnas
+    """
+    term = st.text_input(
+        "🔎 Buscar", 
+        placeholder="Ticker o nombre",
+        key="search_term",
+        on_change=mark_filters_as_modified,
+        help="Buscar por símbolo o nombre de empresa"
+    )
+    if term and term.strip():
+        matches = search_rows(search_index, term)
+        if len(matches) == 0:
+            st.caption("Sin coincidencias")
+        else:
+            # Un único bloque de texto con todas las sugerencias, no un elemento por fila
+            suggestions = df.iloc[matches[:SEARCH_SUGGESTIONS]]
+            rows = suggestions.reindex(columns=['Symbol', 'Company Name', 'Country']).astype(object).fillna('')
+            lines = [f"{len(matches):,} coincidencias"] + [
+                f"**{symbol}** · {name} ({country or 'N/D'})" for symbol, name, country in rows.itertuples(index=False)
+            ]
+            st.caption("  \n".join(lines))
+    return term
 
 def get_filter_initial_value(key, default_value, screener_config=None):
     """
@@ -1859,159 +2467,852 @@ def capture_current_filter_values():
     
     return current_filters
 
-def create_beautiful_html_table(df):
-    """Crea una tabla HTML hermosa con estilos personalizados"""
+# Filtros de rango: columna -> claves de active_filters con el mínimo y el máximo
+FILTER_COLUMN_MAPPING = {
+    # Capitalización
+    'Market Cap': {'min': 'market_cap_min', 'max': 'market_cap_max'},
+    
+    # Valoración
+    'PE Ratio': {'min': 'pe_min', 'max': 'pe_max'},
+    'Forward PE': {'min': 'forward_pe_min', 'max': 'forward_pe_max'},
+    'PB Ratio': {'min': 'pb_min', 'max': 'pb_max'},
+    'PS Ratio': {'min': 'ps_min', 'max': 'ps_max'},
+    'Forward PS': {'min': 'forward_ps_min', 'max': 'forward_ps_max'},
+    'PEG Ratio': {'min': 'peg_min', 'max': 'peg_max'},
+    'P/FCF': {'min': 'p_fcf_min', 'max': 'p_fcf_max'},
+    'P/OCF': {'min': 'p_ocf_min', 'max': 'p_ocf_max'},
+    'P/EBITDA': {'min': 'p_ebitda_min', 'max': 'p_ebitda_max'},
     
-    html_rows = []
-    for idx, row in df.iterrows():
-        row_html = "<tr>"
-        for col in df.columns:
-            value = row[col]
-            
-            # Estilos específicos por columna
-            if col == 'Symbol':
-                cell_html = f'<td style="font-weight: bold; color: #4a9eff; font-size: 14px;">{value}</td>'
-            elif col == 'Company Name':
-                display_name = str(value)[:40] + '...' if len(str(value)) > 40 else str(value)
-                cell_html = f'<td style="color: #e8e8e8; font-size: 13px;">{display_name}</td>'
-            elif col == 'Country':
-                bg_color = '#4e7ce2' if value == 'United States' else 'linear-gradient(135deg, #667eea 0%, #764ba2 100%)'
-                cell_html = f'''
-                <td>
-                    <span style="background: {bg_color}; color: white; padding: 4px 10px; 
-                                border-radius: 12px; font-size: 11px; font-weight: 600;">
-                        {value}
-                    </span>
-                </td>'''
-            elif col == 'Sector':
-                sector_colors = {
-                    'Technology': '#6366f1',
-                    'Healthcare': '#14b8a6', 
-                    'Financials': '#f59e0b',
-                    'Consumer Discretionary': '#ec4899',
-                    'Communication Services': '#8b5cf6',
-                    'Industrials': '#6b7280',
-                    'Materials': '#84cc16',
-                    'Energy': '#ef4444',
-                    'Consumer Staples': '#06b6d4',
-                    'Utilities': '#fbbf24',
-                    'Real Estate': '#10b981'
-                }
-                bg_color = sector_colors.get(value, '#6b7280')
-                cell_html = f'''
-                <td>
-                    <span style="background: {bg_color}; color: white; padding: 4px 10px; 
-                                border-radius: 12px; font-size: 11px; font-weight: 500;">
-                        {value}
-                    </span>
-                </td>'''
-            elif col == 'Market Cap':
-                formatted_val = format_number(value, prefix='$') if pd.notna(value) else '-'
-                cell_html = f'<td style="color: #ffd700; font-weight: 500;">{formatted_val}</td>'
-            elif 'Score' in col:
-                if pd.notna(value):
-                    color = '#10b981' if value >= 75 else '#f59e0b' if value >= 50 else '#ef4444'
-                    bar_width = int(value) if value > 0 else 0
-                    cell_html = f'''
-                    <td>
-                        <div style="display: flex; align-items: center; justify-content: center;">
-                            <div style="background: rgba(255,255,255,0.1); border-radius: 10px; 
-                                       height: 20px; width: 100px; position: relative; overflow: hidden;">
-                                <div style="background: linear-gradient(90deg, {color}, {color}CC); 
-                                           height: 100%; width: {bar_width}%; border-radius: 10px;"></div>
-                                <span style="position: absolute; left: 50%; transform: translateX(-50%); 
-                                            color: white; font-weight: bold; font-size: 12px; 
-                                            line-height: 20px; text-shadow: 1px 1px 2px rgba(0,0,0,0.5);">
-                                    {value:.0f}
-                                </span>
-                            </div>
-                        </div>
-                    </td>'''
-                else:
-                    cell_html = '<td>-</td>'
+    # Enterprise Value
+    'EV/Sales': {'min': 'ev_sales_min', 'max': 'ev_sales_max'},
+    'EV/EBITDA': {'min': 'ev_ebitda_min', 'max': 'ev_ebitda_max'},
+    'EV/EBIT': {'min': 'ev_ebit_min', 'max': 'ev_ebit_max'},
+    'EV/FCF': {'min': 'ev_fcf_min', 'max': 'ev_fcf_max'},
+    
+    # Yields
+    'FCF Yield': {'min': 'fcf_yield_min'},
+    'Earnings Yield': {'min': 'earnings_yield_min'},
+    'Graham (%)': {'min': 'graham_upside_min'},
+    'Lynch (%)': {'min': 'lynch_upside_min'},
+    
+    # Crecimiento
+    'Rev. Growth': {'min': 'rev_growth_min', 'max': 'rev_growth_max'},
+    'Rev. Growth (Q)': {'min': 'rev_growth_q_min', 'max': 'rev_growth_q_max'},
+    'Rev. Growth 3Y': {'min': 'rev_growth_3y_min'},
+    'Rev. Growth 5Y': {'min': 'rev_growth_5y_min'},
+    'EPS Growth': {'min': 'eps_growth_min', 'max': 'eps_growth_max'},
+    'EPS Growth (Q)': {'min': 'eps_growth_q_min', 'max': 'eps_growth_q_max'},
+    'EPS Growth 3Y': {'min': 'eps_growth_3y_min'},
+    'EPS Growth 5Y': {'min': 'eps_growth_5y_min'},
+    'Rev Gr. This Y': {'min': 'rev_gr_this_y_min'},
+    'Rev Gr. Next Y': {'min': 'rev_gr_next_y_min'},
+    'EPS Gr. This Y': {'min': 'eps_gr_this_y_min'},
+    'EPS Gr. Next Y': {'min': 'eps_gr_next_y_min'},
+    'FCF Growth': {'min': 'fcf_growth_min'},
+    
+    # Rentabilidad
+    'ROE': {'min': 'roe_min', 'max': 'roe_max'},
+    'ROA': {'min': 'roa_min', 'max': 'roa_max'},
+    'ROIC': {'min': 'roic_min', 'max': 'roic_max'},
+    'ROCE': {'min': 'roce_min', 'max': 'roce_max'},
+    'ROE (5Y)': {'min': 'roe_5y_min'},
+    'ROA (5Y)': {'min': 'roa_5y_min'},
+    'ROIC (5Y)': {'min': 'roic_5y_min'},
+    
+    # Márgenes
+    'Gross Margin': {'min': 'gross_margin_min', 'max': 'gross_margin_max'},
+    'Oper. Margin': {'min': 'operating_margin_min', 'max': 'operating_margin_max'},
+    'Pretax Margin': {'min': 'pretax_margin_min', 'max': 'pretax_margin_max'},
+    'Profit Margin': {'min': 'profit_margin_min', 'max': 'profit_margin_max'},
+    'FCF Margin': {'min': 'fcf_margin_min', 'max': 'fcf_margin_max'},
+    'EBITDA Margin': {'min': 'ebitda_margin_min', 'max': 'ebitda_margin_max'},
+    'EBIT Margin': {'min': 'ebit_margin_min', 'max': 'ebit_margin_max'},
+    
+    # Salud Financiera
+    'Current Ratio': {'min': 'current_ratio_min', 'max': 'current_ratio_max'},
+    'Quick Ratio': {'min': 'quick_ratio_min', 'max': 'quick_ratio_max'},
+    'Debt / Equity': {'min': 'debt_equity_min', 'max': 'debt_equity_max'},
+    'Debt / EBITDA': {'min': 'debt_ebitda_min', 'max': 'debt_ebitda_max'},
+    'Debt / FCF': {'min': 'debt_fcf_min', 'max': 'debt_fcf_max'},
+    'Z-Score': {'min': 'z_score_min', 'max': 'z_score_max'},
+    'F-Score': {'min': 'f_score_min', 'max': 'f_score_max'},
+    'Int. Cov.': {'min': 'interest_coverage_min', 'max': 'interest_coverage_max'},
+    'FCF': {'min': 'fcf_min', 'max': 'fcf_max'},
+    
+    # Dividendos
+    'Years': {'min': 'years_min', 'max': 'years_max'},
+    'Div. Yield': {'min': 'div_yield_min', 'max': 'div_yield_max'},
+    'Payout Ratio': {'min': 'payout_ratio_min', 'max': 'payout_ratio_max'},
+    'Div. Growth': {'min': 'div_growth_1y_min', 'max': 'div_growth_1y_max'},
+    'Div. Growth 3Y': {'min': 'div_growth_3y_min', 'max': 'div_growth_3y_max'},
+    'Div. Growth 5Y': {'min': 'div_growth_5y_min', 'max': 'div_growth_5y_max'},
+    'Div. Growth 10Y': {'min': 'div_growth_10y_min', 'max': 'div_growth_10y_max'},
+    'Shareh. Yield': {'min': 'shareholder_yield_min', 'max': 'shareholder_yield_max'},
+    'Buyback Yield': {'min': 'buyback_yield_min', 'max': 'buyback_yield_max'},
+    
+    # Técnico - Retornos
+    'Return 1W': {'min': 'return_1w_min', 'max': 'return_1w_max'},
+    'Return 1M': {'min': 'return_1m_min', 'max': 'return_1m_max'},
+    'Return 3M': {'min': 'return_3m_min', 'max': 'return_3m_max'},
+    'Return 6M': {'min': 'return_6m_min', 'max': 'return_6m_max'},
+    'Return YTD': {'min': 'return_ytd_min', 'max': 'return_ytd_max'},
+    'Return 1Y': {'min': 'return_1y_min', 'max': 'return_1y_max'},
+    'Return 3Y': {'min': 'return_3y_min', 'max': 'return_3y_max'},
+    'Return 5Y': {'min': 'return_5y_min', 'max': 'return_5y_max'},
+    'Return 10Y': {'min': 'return_10y_min', 'max': 'return_10y_max'},
+    
+    # Técnico - Indicadores
+    'RSI': {'min': 'rsi_min', 'max': 'rsi_max'},
+    'RSI (W)': {'min': 'rsi_w_min', 'max': 'rsi_w_max'},
+    'RSI (M)': {'min': 'rsi_m_min', 'max': 'rsi_m_max'},
+    'Beta (5Y)': {'min': 'beta_min', 'max': 'beta_max'},
+    'ATR': {'min': 'atr_min', 'max': 'atr_max'},
+    'Rel. Volume': {'min': 'rel_volume_min', 'max': 'rel_volume_max'},
+    
+    # Propiedad
+    'Employees': {'min': 'employees_min'},
+    'Founded': {'min': 'founded_after'},
+    'Shares Insiders': {'min': 'insider_ownership_min', 'max': 'insider_ownership_max'},
+    'Shares Institut.': {'min': 'institutional_ownership_min', 'max': 'institutional_ownership_max'},
+    'Analysts': {'min': 'analysts_min', 'max': 'analysts_max'},
+    'Short % Float': {'min': 'short_float_min', 'max': 'short_float_max'},
+    'Short % Shares': {'min': 'short_shares_min', 'max': 'short_shares_max'},
+    'Short Ratio': {'min': 'short_ratio_min', 'max': 'short_ratio_max'},
+    
+    # Scores
+    'Quality_Score': {'min': 'quality_score_min'},
+    'Value_Score': {'min': 'value_score_min'},
+    'Growth_Score': {'min': 'growth_score_min'},
+    'Financial_Health_Score': {'min': 'financial_health_score_min'},
+    'Momentum_Score': {'min': 'momentum_score_min'},
+    'Master_Score': {'min': 'master_score_min'}
+}
+
+def build_filter_predicates(active_filters, columns):
+    """
+    Traduce active_filters a una lista de predicados independientes.
+    Cada predicado es un dict con la clave del filtro, la columna, el operador y el valor.
+    """
+    predicates = []
+    
+    # Búsqueda de texto
+    if active_filters.get('search_term'):
+        predicates.append({'key': 'search_term', 'column': 'Symbol', 'op': 'search',
+                           'value': active_filters['search_term']})
+    
+    # Países, sectores, industrias, bolsas y grupos de capitalización
+    membership_filters = [
+        ('countries', 'Country', 'in'),
+        ('exclude_countries', 'Country', 'not_in'),
+        ('sectors', 'Sector', 'in'),
+        ('industries_filter', 'Industry', 'in'),
+        ('exchanges_filter', 'Exchange', 'in'),
+        ('mc_groups_filter', 'MC Group', 'in')
+    ]
+    for key, column, op in membership_filters:
+        if key in active_filters and column in columns:
+            predicates.append({'key': key, 'column': column, 'op': op, 'value': active_filters[key]})
+    
+    # Filtros de rango
+    for column, limits in FILTER_COLUMN_MAPPING.items():
+        if column not in columns:
+            continue
+        for bound, op in (('min', '>='), ('max', '<=')):
+            key = limits.get(bound)
+            if key and active_filters.get(key) is not None:
+                predicates.append({'key': key, 'column': column, 'op': op, 'value': active_filters[key]})
+    
+    # Distancia desde máximo y mínimo de 52 semanas
+    if 'distance_52w_high_max' in active_filters and '52W High Chg' in columns:
+        predicates.append({'key': 'distance_52w_high_max', 'column': '52W High Chg', 'op': '>=',
+                           'value': -active_filters['distance_52w_high_max']})
+    if 'distance_52w_low_min' in active_filters and '52W Low Chg' in columns:
+        predicates.append({'key': 'distance_52w_low_min', 'column': '52W Low Chg', 'op': '>=',
+                           'value': active_filters['distance_52w_low_min']})
+    
+    return predicates
+
+def evaluate_predicate(df, predicate, rows=None, bitmap_index=None, search_index=None):
+    """
+    Evalúa un predicado y devuelve una máscara booleana NumPy.
+    Si se pasan rows (posiciones), solo se evalúan esas filas.
+    Los filtros de pertenencia usan los bitmaps precalculados cuando la columna los tiene,
+    y la búsqueda el índice de trigramas.
+    """
+    op = predicate['op']
+    value = predicate['value']
+    
+    def column(name):
+        return df[name] if rows is None else df[name].iloc[rows]
+    
+    if op == 'search':
+        if search_index is not None:
+            mask = np.zeros(search_index['size'], dtype=bool)
+            mask[search_rows(search_index, value)] = True
+            return mask if rows is None else mask[rows]
+        symbol_term = str(value).strip().upper()
+        name_term = normalize_search_text([value]).iloc[0]
+        mask = np.zeros(len(df) if rows is None else len(rows), dtype=bool)
+        if symbol_term:
+            mask |= column('Symbol').astype(str).str.upper().str.contains(symbol_term, regex=False).to_numpy()
+        if name_term:
+            mask |= normalize_search_text(column('Company Name')).str.contains(name_term, regex=False).to_numpy()
+        return mask
+    if op in ('in', 'not_in'):
+        if bitmap_index is not None and predicate['column'] in bitmap_index['columns']:
+            bitmap = select_bitmap(bitmap_index, predicate['column'], value)
+            mask = bitmap_to_mask(bitmap_index, bitmap, rows)
+        else:
+            mask = column(predicate['column']).isin(value).to_numpy()
+        return mask if op == 'in' else ~mask
+    
+    values = column(predicate['column']).to_numpy()
+    if op == '>=':
+        return values >= value
+    return values <= value
+
+def compute_filter_mask(df, predicates, bitmap_index=None, search_index=None):
+    """Combina las máscaras de todos los predicados con una única reducción &"""
+    if not predicates:
+        return np.ones(len(df), dtype=bool)
+    return np.logical_and.reduce([evaluate_predicate(df, predicate, bitmap_index=bitmap_index, search_index=search_index)
+                                  for predicate in predicates])
+
+# Columnas numéricas con índice ordenado para resolver filtros de rango
+RANGE_INDEX_COLUMNS = list(FILTER_COLUMN_MAPPING) + ['52W High Chg', '52W Low Chg']
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def get_range_index(data_version, _df):
+    """
+    Índice de rangos por versión del dataset: para cada métrica filtrable, el orden de las
+    filas y los valores ordenados (sin NaN). Cada columna se ordena la primera vez que un
+    filtro la usa, para no leer del almacén columnas que nadie filtra
+    """
+    columns = {
+        column for column in RANGE_INDEX_COLUMNS
+        if column in _df.columns and pd.api.types.is_numeric_dtype(_df[column])
+    }
+    return {'df': _df, 'columns': columns, 'entries': {}}
+
+def get_range_entry(range_index, column):
+    """Orden y valores ordenados de una columna del índice de rangos, construidos bajo demanda"""
+    entry = range_index['entries'].get(column)
+    if entry is None:
+        values = range_index['df'][column].to_numpy()
+        valid = np.flatnonzero(~pd.isna(values))
+        order = valid[np.argsort(values[valid], kind='stable')].astype(np.int32)
+        entry = {'order': order, 'sorted': values[order]}
+        range_index['entries'][column] = entry
+    return entry
+
+def lookup_range(entry, low=None, high=None):
+    """Devuelve las posiciones de las filas con low <= valor <= high usando dos searchsorted"""
+    sorted_values = entry['sorted']
+    if np.issubdtype(sorted_values.dtype, np.floating):
+        # Comparar en el mismo tipo que la columna (float32 en modo compacto), igual que la máscara
+        low = None if low is None else sorted_values.dtype.type(low)
+        high = None if high is None else sorted_values.dtype.type(high)
+    start = 0 if low is None else np.searchsorted(sorted_values, low, side='left')
+    stop = len(sorted_values) if high is None else np.searchsorted(sorted_values, high, side='right')
+    return entry['order'][start:stop]
+
+def compute_filtered_positions(df, predicates, range_index, bitmap_index=None, search_index=None):
+    """
+    Resuelve los filtros con el índice de rangos:
+    1. Cada columna con filtro numérico se traduce a un conjunto de filas con dos searchsorted
+    2. Se parte del conjunto más pequeño (el filtro más selectivo)
+    3. Los demás rangos y predicados solo se comprueban sobre los candidatos que quedan
+    """
+    bounds = {}
+    other_predicates = []
+    for predicate in predicates:
+        column = predicate['column']
+        if predicate['op'] in ('>=', '<=') and column in range_index['columns']:
+            low, high = bounds.get(column, (None, None))
+            if predicate['op'] == '>=':
+                low = predicate['value'] if low is None else max(low, predicate['value'])
             else:
-                # Formato general para otras columnas
-                display_val = str(value) if pd.notna(value) else '-'
-                if isinstance(value, (int, float)) and pd.notna(value):
-                    if any(keyword in col for keyword in ['Growth', 'Return', 'Yield', 'Margin', 'ROE', 'ROA', 'ROIC']):
-                        display_val = f"{value:.1f}%"
-                        color = '#10b981' if value > 0 else '#ef4444' if value < 0 else '#e8e8e8'
-                        cell_html = f'<td style="color: {color};">{display_val}</td>'
-                    elif any(keyword in col for keyword in ['Ratio', 'PE', 'PB', 'PS']):
-                        display_val = f"{value:.2f}"
-                        cell_html = f'<td style="color: #e8e8e8;">{display_val}</td>'
-                    else:
-                        cell_html = f'<td style="color: #e8e8e8;">{display_val}</td>'
-                else:
-                    cell_html = f'<td style="color: #e8e8e8;">{display_val}</td>'
-            
-            row_html += cell_html
-        row_html += "</tr>"
-        html_rows.append(row_html)
+                high = predicate['value'] if high is None else min(high, predicate['value'])
+            bounds[column] = (low, high)
+        else:
+            other_predicates.append(predicate)
+    
+    if not bounds:
+        return np.flatnonzero(compute_filter_mask(df, predicates, bitmap_index, search_index))
     
-    # Crear headers
-    headers = ''.join([f'<th>{col}</th>' for col in df.columns])
+    ranges = sorted(
+        ((column, low, high, lookup_range(get_range_entry(range_index, column), low, high)) for column, (low, high) in bounds.items()),
+        key=lambda item: len(item[3])
+    )
+    candidates = np.sort(ranges[0][3])
     
-    # Tabla completa con estilos
-    html_table = f'''
+    for column, low, high, ids in ranges[1:]:
+        if len(candidates) == 0:
+            break
+        if len(ids) <= len(candidates):
+            candidates = np.intersect1d(candidates, ids, assume_unique=True)
+        else:
+            values = df[column].to_numpy()[candidates]
+            keep = np.ones(len(candidates), dtype=bool)
+            if low is not None:
+                keep &= values >= low
+            if high is not None:
+                keep &= values <= high
+            candidates = candidates[keep]
+    
+    for predicate in other_predicates:
+        if len(candidates) == 0:
+            break
+        candidates = candidates[evaluate_predicate(df, predicate, rows=candidates, bitmap_index=bitmap_index,
+                                                   search_index=search_index)]
+    
+    return candidates
+
+def filter_fingerprint(active_filters):
+    """Hash canónico de active_filters: no depende del orden de las claves ni de las listas"""
+    canonical = {}
+    for key, value in active_filters.items():
+        if isinstance(value, (list, tuple, set)):
+            canonical[key] = sorted(str(item) for item in value)
+        elif isinstance(value, (int, float, np.number)) and not isinstance(value, bool):
+            canonical[key] = float(value)
+        else:
+            canonical[key] = str(value)
+    payload = json.dumps(canonical, sort_keys=True)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+# Número máximo de resultados de screening guardados (compartidos entre sesiones, expulsión LRU)
+FILTER_CACHE_SIZE = 128
+
+@st.cache_data(max_entries=FILTER_CACHE_SIZE, show_spinner=False)
+def get_filtered_positions(fingerprint, data_version, _df, _active_filters):
+    """Posiciones de las filas que cumplen los filtros, cacheadas por huella de filtros y versión del dataset"""
+    predicates = build_filter_predicates(_active_filters, _df.columns)
+    return compute_filtered_positions(
+        _df, predicates, get_range_index(data_version, _df), get_bitmap_index(data_version, _df),
+        get_search_index(data_version, _df)
+    )
+
+def apply_filters(df, active_filters):
+    """
+    Aplica todos los filtros activos y materializa el DataFrame resultante una sola vez.
+    Si pasan todas las filas se devuelve el propio df, sin copiar las columnas del almacén
+    """
+    positions = get_filtered_positions(
+        filter_fingerprint(active_filters), get_dataset_version(df), df, active_filters
+    )
+    if len(positions) == len(df) and (len(positions) == 0 or np.all(positions[1:] > positions[:-1])):
+        return df
+    return df.iloc[positions]
+
+@st.cache_data(max_entries=FILTER_CACHE_SIZE, show_spinner=False)
+def get_sorted_positions(fingerprint, data_version, sort_column, ascending, _df, _active_filters):
+    """
+    Posiciones de los resultados en el orden de la tabla, cacheadas por huella de filtros,
+    versión del dataset y orden, para que la paginación sea estable entre páginas
+    """
+    positions = get_filtered_positions(fingerprint, data_version, _df, _active_filters)
+    if sort_column not in _df.columns:
+        return positions
+    return positions[top_k_positions(_df[sort_column].iloc[positions], len(positions), ascending)]
+
+# Métricas del mapa de calor sectorial
+SECTOR_HEATMAP_METRICS = ['ROE', 'ROA', 'Profit Margin', 'Rev. Growth', 'Return 1Y']
+
+@st.cache_data(max_entries=FILTER_CACHE_SIZE, show_spinner=False)
+def get_sector_summary(fingerprint, data_version, _filtered_df):
+    """Métricas por sector y medianas del mapa de calor de un resultado, cacheadas por huella de filtros"""
+    grouped = _filtered_df.groupby('Sector', observed=True)
+    sector_metrics = grouped.agg({
+        'Symbol': 'count',
+        'Market Cap': ['sum', 'mean', 'median'],
+        'PE Ratio': 'median',
+        'ROE': 'median',
+        'Rev. Growth': 'median',
+        'Profit Margin': 'median',
+        'Debt / Equity': 'median',
+        'Return 1Y': 'median',
+        'Master_Score': 'mean'
+    }).round(2)
+    sector_metrics.columns = ['Acciones', 'Cap. Total', 'Cap. Media', 'Cap. Mediana',
+                              'P/E Med', 'ROE Med', 'Crec. Ingresos Med', 
+                              'Margen Neto Med', 'D/E Med', 'Retorno 1A Med', 'Score Promedio']
+    sector_metrics = sector_metrics.sort_values('Acciones', ascending=False)
+    available = [metric for metric in SECTOR_HEATMAP_METRICS if metric in _filtered_df.columns]
+    heatmap_df = grouped[available].median().reindex(columns=SECTOR_HEATMAP_METRICS, fill_value=0)
+    return sector_metrics, heatmap_df
+
+@st.cache_data(max_entries=FILTER_CACHE_SIZE, show_spinner=False)
+def get_country_summary(fingerprint, data_version, _filtered_df):
+    """Métricas por país de un resultado, cacheadas por huella de filtros"""
+    country_metrics = _filtered_df.groupby('Country', observed=True).agg({
+        'Symbol': 'count',
+        'Market Cap': 'sum',
+        'Master_Score': 'mean',
+        'PE Ratio': 'median',
+        'ROE': 'median',
+        'Return 1Y': 'median'
+    }).round(2)
+    country_metrics.columns = ['Acciones', 'Cap. Total', 'Score Prom', 
+                               'P/E Med', 'ROE Med', 'Ret. 1A Med']
+    return country_metrics.sort_values('Acciones', ascending=False)
+
+@st.cache_data(max_entries=FILTER_CACHE_SIZE, show_spinner=False)
+def get_correlation_matrix(fingerprint, data_version, columns, _filtered_df):
+    """Matriz de correlación de las columnas indicadas, cacheada por huella de filtros"""
+    return _filtered_df[columns].corr()
+
+# Número de ficheros exportados guardados
+EXPORT_CACHE_SIZE = 16
+# Compresión de las exportaciones Parquet y Arrow IPC (Feather)
+COLUMNAR_COMPRESSION = 'zstd'
+
+@st.cache_data(max_entries=EXPORT_CACHE_SIZE, show_spinner=False)
+def build_export(fingerprint, data_version, columns, export_format, _export_df):
+    """
+    Genera el fichero de exportación (csv, xlsx, json, parquet o feather) solo cuando se pide la descarga.
+    Cacheado por huella de filtros, columnas y formato
+    """
+    if export_format == 'csv':
+        return _export_df.to_csv(index=False).encode('utf-8')
+    if export_format == 'json':
+        return _export_df.to_json(orient='records', indent=2).encode('utf-8')
+    if export_format in ('parquet', 'feather'):
+        # Formatos columnares: conservan fechas, categorías y scores con sus tipos
+        buffer = io.BytesIO()
+        arrow_df = to_arrow_compatible(_export_df).reset_index(drop=True)
+        if export_format == 'parquet':
+            arrow_df.to_parquet(buffer, index=False, compression=COLUMNAR_COMPRESSION)
+        else:
+            arrow_df.to_feather(buffer, compression=COLUMNAR_COMPRESSION)
+        return buffer.getvalue()
+    
+    buffer = io.BytesIO()
+    with pd.ExcelWriter(buffer, engine='xlsxwriter') as writer:
+        _export_df.to_excel(writer, sheet_name='Resultados', index=False)
+        # Add summary sheet
+        pd.DataFrame({
+            'Métrica': ['Total', 'Países', 'Sectores'],
+            'Valor': [
+                len(_export_df),
+                _export_df['Country'].nunique() if 'Country' in _export_df.columns else 0,
+                _export_df['Sector'].nunique() if 'Sector' in _export_df.columns else 0
+            ]
+        }).to_excel(writer, sheet_name='Resumen', index=False)
+    return buffer.getvalue()
+
+def remember_selection(key):
+    """
+    Callback de los widgets de los paneles de resultados: copia su valor a una clave propia,
+    porque Streamlit borra el estado de un widget en cuanto su panel deja de dibujarse
+    """
+    st.session_state[f"{key}_saved"] = st.session_state[key]
+
+def saved_selection(key, default, options=None):
+    """Valor guardado por remember_selection (limitado a las opciones actuales) o el valor por defecto"""
+    value = st.session_state.get(f"{key}_saved", default)
+    if options is None:
+        return value
+    if isinstance(value, list):
+        return [item for item in value if item in options]
+    return value if value in options else default
+
+def set_results_page(state_key, page):
+    """Callback de los botones de paginación"""
+    st.session_state[state_key] = page
+
+def jump_to_symbol(state_key, symbols, page_size):
+    """Callback de 'Ir a símbolo': salta a la página que contiene el símbolo buscado"""
+    symbol = st.session_state[f"{state_key}_symbol"].strip().upper()
+    matches = np.flatnonzero(symbols == symbol) if symbol else []
+    if len(matches):
+        st.session_state[state_key] = int(matches[0]) // page_size
+        st.session_state[f"{state_key}_missing"] = None
+    else:
+        st.session_state[f"{state_key}_missing"] = symbol or None
+
+def render_pagination(sorted_positions, symbols, page_size, state_key, view):
+    """
+    Controles de paginación (anterior, siguiente, ir a símbolo) sobre posiciones ya ordenadas;
+    devuelve solo las posiciones de la página actual. La página vuelve a 0 si cambia la vista
+    """
+    if st.session_state.get(f"{state_key}_view") != view:
+        st.session_state[f"{state_key}_view"] = view
+        st.session_state[state_key] = 0
+    total = len(sorted_positions)
+    n_pages = max(1, -(-total // page_size))
+    page = min(st.session_state.get(state_key, 0), n_pages - 1)
+    page_symbols = symbols[sorted_positions]
+    
+    col1, col2, col3, col4 = st.columns([1, 2, 1, 2])
+    with col1:
+        st.button("◀ Anterior", key=f"{state_key}_prev", disabled=page == 0,
+                  on_click=set_results_page, args=(state_key, page - 1), use_container_width=True)
+    with col2:
+        start = page * page_size
+        stop = min(start + page_size, total)
+        st.markdown(f"Página **{page + 1}** de {n_pages} · filas {start + 1 if total else 0:,}-{stop:,} de {total:,}")
+    with col3:
+        st.button("Siguiente ▶", key=f"{state_key}_next", disabled=page >= n_pages - 1,
+                  on_click=set_results_page, args=(state_key, page + 1), use_container_width=True)
+    with col4:
+        st.text_input("Ir a símbolo", key=f"{state_key}_symbol", placeholder="Ir a símbolo (ej: AAPL)",
+                      label_visibility="collapsed", on_change=jump_to_symbol,
+                      args=(state_key, page_symbols, page_size))
+    missing = st.session_state.get(f"{state_key}_missing")
+    if missing:
+        st.caption(f"'{missing}' no está en los resultados")
+    return sorted_positions[start:stop]
+
+# Máscaras de predicados individuales guardadas (empaquetadas, compartidas entre sesiones)
+PREDICATE_CACHE_SIZE = 512
+
+@st.cache_data(max_entries=PREDICATE_CACHE_SIZE, show_spinner=False)
+def get_predicate_bitmap(fingerprint, data_version, _df, _predicate):
+    """Máscara empaquetada de un único predicado, cacheada por su huella y la versión del dataset"""
+    mask = evaluate_predicate(
+        _df, _predicate,
+        bitmap_index=get_bitmap_index(data_version, _df),
+        search_index=get_search_index(data_version, _df)
+    )
+    return np.packbits(mask)
+
+def get_predicate_masks(df, predicates):
+    """Matriz booleana (predicados x filas) construida desde la caché de máscaras por predicado"""
+    data_version = get_dataset_version(df)
+    return np.vstack([
+        np.unpackbits(
+            get_predicate_bitmap(filter_fingerprint({predicate['key']: predicate['value']}), data_version, df, predicate),
+            count=len(df)
+        ).astype(bool)
+        for predicate in predicates
+    ])
+
+def compute_pending_counts(df, pending_filters):
+    """
+    Filas que quedan con los valores pendientes (sin aplicar) y, por predicado,
+    las filas que elimina él solo: las que cumplen todos los demás pero no este
+    """
+    predicates = build_filter_predicates(pending_filters, df.columns)
+    if not predicates:
+        return {'total': len(df), 'remaining': len(df), 'predicates': []}
+    masks = get_predicate_masks(df, predicates)
+    fail_count = (~masks).sum(axis=0, dtype=np.int32)
+    removed = (~masks & (fail_count == 1)).sum(axis=1)
+    return {
+        'total': len(df),
+        'remaining': int((fail_count == 0).sum()),
+        'predicates': [dict(predicate, removed=int(count)) for predicate, count in zip(predicates, removed)],
+    }
+
+def compute_filter_funnel(df, predicates):
+    """
+    Embudo de filtros en una sola pasada vectorizada sobre las máscaras cacheadas:
+    por predicado, filas que elimina aplicado solo, supervivientes acumulados en orden
+    de aplicación y filas que fallan únicamente ese predicado
+    """
+    masks = get_predicate_masks(df, predicates)
+    survivors = np.logical_and.accumulate(masks, axis=0).sum(axis=1)
+    fail_count = (~masks).sum(axis=0, dtype=np.int32)
+    return pd.DataFrame({
+        'Filtro': [describe_predicate(predicate) for predicate in predicates],
+        'Elimina por sí solo': len(df) - masks.sum(axis=1),
+        'Supervivientes acumulados': survivors,
+        'Eliminadas en este paso': np.concatenate(([len(df)], survivors[:-1])) - survivors,
+        'Fallan solo este': (~masks & (fail_count == 1)).sum(axis=1),
+    })
+
+def render_filter_funnel(df, active_filters):
+    """Diagnóstico de un screening sobre-restringido: gráfico de embudo y tabla por filtro"""
+    predicates = build_filter_predicates(active_filters, df.columns)
+    if not predicates:
+        return
+    funnel_df = compute_filter_funnel(df, predicates)
+    st.markdown("#### 🔬 Embudo de Filtros")
+    fig = go.Figure(go.Funnel(
+        y=['Universo'] + funnel_df['Filtro'].tolist(),
+        x=[len(df)] + funnel_df['Supervivientes acumulados'].tolist(),
+        textinfo='value+percent initial'
+    ))
+    fig.update_layout(template='plotly_dark', height=max(300, 45 * (len(funnel_df) + 1)),
+                      margin=dict(l=10, r=10, t=10, b=10))
+    st.plotly_chart(fig, use_container_width=True)
+    st.dataframe(funnel_df, use_container_width=True, hide_index=True)
+    blocking = funnel_df[funnel_df['Fallan solo este'] > 0].sort_values('Fallan solo este', ascending=False)
+    if not blocking.empty:
+        top = blocking.iloc[0]
+        st.info(f"💡 Relajando solo **{top['Filtro']}** aparecerían {int(top['Fallan solo este']):,} acciones")
+
+# Máximo de criterios incumplidos y de filas mostradas en el modo "casi cumplen"
+NEAR_MISS_MAX_FAILURES = 2
+NEAR_MISS_MAX_ROWS = 500
+
+def describe_miss(df, predicate, rows):
+    """Para las filas que fallan un predicado, su valor y cuánto les falta para cumplirlo"""
+    if predicate['op'] == 'search':
+        return ["sin coincidencia de texto"] * len(rows)
+    values = df[predicate['column']].iloc[rows]
+    if predicate['op'] in ('in', 'not_in'):
+        return [f"{predicate['column']}: {value}" for value in values]
+    # A float antes de restar: en modo compacto los scores son uint8 y la resta desbordaría
+    numbers = values.to_numpy(dtype=float, na_value=np.nan)
+    gaps = np.abs(numbers - predicate['value'])
+    return [
+        f"{describe_predicate(predicate)}: sin dato" if np.isnan(value)
+        else f"{describe_predicate(predicate)}: {value:,.4g} (a {gap:,.4g})"
+        for value, gap in zip(numbers, gaps)
+    ]
+
+def compute_near_misses(df, predicates, max_failures=NEAR_MISS_MAX_FAILURES, max_rows=NEAR_MISS_MAX_ROWS):
+    """
+    Acciones que incumplen entre 1 y max_failures predicados, a partir de la suma
+    de las máscaras de fallo; indica qué criterios fallan y por cuánto
+    """
+    masks = get_predicate_masks(df, predicates)
+    fail_count = (~masks).sum(axis=0, dtype=np.int32)
+    near = np.flatnonzero((fail_count >= 1) & (fail_count <= max_failures))
+    total = len(near)
+    if 'Master_Score' in df.columns:
+        scores = df['Master_Score'].to_numpy(dtype=float)[near]
+        near = near[np.lexsort((-np.nan_to_num(scores, nan=-np.inf), fail_count[near]))]
+    else:
+        near = near[np.argsort(fail_count[near], kind='stable')]
+    near = near[:max_rows]
+    
+    misses = [[] for _ in near]
+    for predicate, mask in zip(predicates, masks):
+        failing = np.flatnonzero(~mask[near])
+        for position, text in zip(failing, describe_miss(df, predicate, near[failing])):
+            misses[position].append(text)
+    
+    base_cols = [col for col in ['Symbol', 'Company Name', 'Country', 'Sector', 'Market Cap', 'Master_Score'] if col in df.columns]
+    near_df = df.iloc[near][base_cols].copy()
+    near_df.insert(0, 'Fallos', fail_count[near])
+    near_df['Criterios no cumplidos'] = [' · '.join(items) for items in misses]
+    return near_df, total
+
+def render_near_misses(df, active_filters, key_prefix):
+    """Tabla de acciones que se quedan a 1-k criterios de pasar el screening"""
+    predicates = build_filter_predicates(active_filters, df.columns)
+    if len(predicates) < 2:
+        st.info("El modo 'casi cumplen' necesita al menos dos filtros activos")
+        return
+    options = list(range(1, min(len(predicates) - 1, 5) + 1))
+    max_failures = st.select_slider(
+        "Máximo de criterios incumplidos:",
+        options=options,
+        value=saved_selection(f"{key_prefix}_near_miss_k", min(NEAR_MISS_MAX_FAILURES, len(predicates) - 1), options),
+        key=f"{key_prefix}_near_miss_k",
+        on_change=remember_selection,
+        args=(f"{key_prefix}_near_miss_k",)
+    )
+    near_df, total = compute_near_misses(df, predicates, max_failures)
+    if total == 0:
+        st.info("Ninguna acción se queda tan cerca de cumplir los criterios")
+        return
+    st.caption(f"{total:,} acciones incumplen entre 1 y {max_failures} criterios"
+               + (f" (se muestran las {len(near_df):,} primeras)" if total > len(near_df) else ""))
+    st.dataframe(near_df, use_container_width=True, hide_index=True)
+
+# Puntos por curva de sensibilidad de umbrales
+SENSITIVITY_POINTS = 60
+
+def compute_threshold_curves(df, predicates, points=SENSITIVITY_POINTS):
+    """
+    Para cada filtro de rango, número de resultados al mover su umbral con el resto fijo:
+    se ordenan una vez los valores de los supervivientes de los demás filtros y cada
+    punto de la curva es un searchsorted (conteo acumulado)
+    """
+    masks = get_predicate_masks(df, predicates)
+    fail_count = (~masks).sum(axis=0, dtype=np.int32)
+    curves = []
+    for predicate, mask in zip(predicates, masks):
+        if predicate['op'] not in ('>=', '<=') or not pd.api.types.is_numeric_dtype(df[predicate['column']]):
+            continue
+        others_pass = (fail_count - ~mask) == 0
+        values = df[predicate['column']].to_numpy(dtype=float)[others_pass]
+        values = np.sort(values[~np.isnan(values)])
+        if len(values) == 0:
+            continue
+        low, high = np.quantile(values, [0.01, 0.99])
+        thresholds = np.linspace(min(low, predicate['value']), max(high, predicate['value']), points)
+        if predicate['op'] == '>=':
+            counts = len(values) - np.searchsorted(values, thresholds, side='left')
+        else:
+            counts = np.searchsorted(values, thresholds, side='right')
+        curves.append((predicate, pd.DataFrame({'Umbral': thresholds, 'Resultados': counts})))
+    return curves
+
+def render_threshold_sensitivity(df, pending_filters):
+    """Curvas de sensibilidad de los filtros de rango pendientes, dos por fila"""
+    predicates = build_filter_predicates(pending_filters, df.columns)
+    curves = compute_threshold_curves(df, predicates) if predicates else []
+    if not curves:
+        st.caption("Activa algún filtro de mínimo o máximo para ver cómo cambia el número de resultados")
+        return
+    for start in range(0, len(curves), 2):
+        cols = st.columns(2)
+        for col, (predicate, curve_df) in zip(cols, curves[start:start + 2]):
+            with col:
+                fig = px.line(curve_df, x='Umbral', y='Resultados', title=describe_predicate(predicate))
+                fig.add_vline(x=predicate['value'], line_dash='dash', line_color='#f59e0b')
+                fig.update_layout(template='plotly_dark', height=250, margin=dict(l=10, r=10, t=40, b=10))
+                st.plotly_chart(fig, use_container_width=True)
+
+def describe_predicate(predicate):
+    """Texto corto de un predicado: columna, operador y valor"""
+    value = predicate['value']
+    if isinstance(value, (list, tuple)):
+        value = ', '.join(str(item) for item in value[:3]) + (f" (+{len(value) - 3})" if len(value) > 3 else "")
+    elif isinstance(value, (float, np.floating)):
+        value = f"{value:,.4g}"
+    symbols = {'>=': '≥', '<=': '≤', 'in': 'en', 'not_in': 'excluye', 'search': 'contiene'}
+    column = 'Símbolo / Nombre' if predicate['op'] == 'search' else predicate['column']
+    return f"{column} {symbols[predicate['op']]} {value}"
+
+def render_pending_counts(pending_counts):
+    """Resumen en vivo de los filtros pendientes: filas que quedan y filas que elimina cada filtro"""
+    remaining = pending_counts['remaining']
+    total = pending_counts['total']
+    st.markdown(f"🧮 Con los valores actuales de los filtros quedan **{remaining:,}** de {total:,} acciones "
+                f"({remaining / total * 100 if total else 0:.1f}%)")
+    if pending_counts['predicates']:
+        with st.expander(f"Impacto de cada filtro ({len(pending_counts['predicates'])} activos)", expanded=remaining == 0):
+            impact_df = pd.DataFrame({
+                'Filtro': [describe_predicate(predicate) for predicate in pending_counts['predicates']],
+                'Elimina': [predicate['removed'] for predicate in pending_counts['predicates']],
+                'Quedarían sin él': [remaining + predicate['removed'] for predicate in pending_counts['predicates']],
+            }).sort_values('Elimina', ascending=False, kind='stable')
+            st.dataframe(impact_df, use_container_width=True, hide_index=True)
+            st.caption("Elimina: acciones que cumplen todos los demás filtros pero no este")
+
+# Colores de los chips de sector en la tabla HTML
+SECTOR_COLORS = {
+    'Technology': '#6366f1',
+    'Healthcare': '#14b8a6', 
+    'Financials': '#f59e0b',
+    'Consumer Discretionary': '#ec4899',
+    'Communication Services': '#8b5cf6',
+    'Industrials': '#6b7280',
+    'Materials': '#84cc16',
+    'Energy': '#ef4444',
+    'Consumer Staples': '#06b6d4',
+    'Utilities': '#fbbf24',
+    'Real Estate': '#10b981'
+}
+PERCENT_KEYWORDS = ['Growth', 'Return', 'Yield', 'Margin', 'ROE', 'ROA', 'ROIC']
+RATIO_KEYWORDS = ['Ratio', 'PE', 'PB', 'PS']
+
+HTML_TABLE_CSS = """
+<style>
+    .bquant-table { width: 100%; border-collapse: collapse; font-family: 'Inter', -apple-system, BlinkMacSystemFont, sans-serif; }
+    .bquant-table th { background: linear-gradient(135deg, #4a9eff 0%, #3a7dd8 100%); color: white; padding: 14px 10px;
+                       text-align: left; font-weight: 600; font-size: 13px; text-transform: uppercase; letter-spacing: 0.5px;
+                       border: none; position: sticky; top: 0; z-index: 10; }
+    .bquant-table tr { border-bottom: 1px solid rgba(74, 158, 255, 0.1); transition: all 0.3s ease; }
+    .bquant-table tr:hover { background: rgba(74, 158, 255, 0.08) !important; transform: scale(1.005);
+                             box-shadow: 0 2px 10px rgba(74, 158, 255, 0.2); }
+    .bquant-table td { padding: 12px 10px; font-size: 13px; color: #e8e8e8; }
+    .bquant-table tbody tr:nth-child(even) { background: rgba(74, 158, 255, 0.03); }
+    .bquant-table .bq-symbol { font-weight: bold; color: #4a9eff; font-size: 14px; }
+    .bquant-table .bq-mcap { color: #ffd700; font-weight: 500; }
+    .bquant-table .bq-pos { color: #10b981; }
+    .bquant-table .bq-neg { color: #ef4444; }
+    .bquant-table .bq-chip { color: white; padding: 4px 10px; border-radius: 12px; font-size: 11px; font-weight: 500;
+                             background: #6b7280; }
+    .bquant-table .bq-country { font-weight: 600; background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); }
+    .bquant-table .bq-country-us { background: #4e7ce2; }
+    .bquant-table .bq-bar { margin: 0 auto; background: rgba(255,255,255,0.1); border-radius: 10px; height: 20px;
+                            width: 100px; position: relative; overflow: hidden; }
+    .bquant-table .bq-bar div { height: 100%; border-radius: 10px; }
+    .bquant-table .bq-bar span { position: absolute; left: 50%; top: 0; transform: translateX(-50%); color: white;
+                                 font-weight: bold; font-size: 12px; line-height: 20px; text-shadow: 1px 1px 2px rgba(0,0,0,0.5); }
+    .bquant-table .bq-good { background: linear-gradient(90deg, #10b981, #10b981CC); }
+    .bquant-table .bq-mid { background: linear-gradient(90deg, #f59e0b, #f59e0bCC); }
+    .bquant-table .bq-bad { background: linear-gradient(90deg, #ef4444, #ef4444CC); }
+""" + ''.join(
+    f"    .bquant-table .bq-sector-{i} {{ background: {color}; }}\n" for i, color in enumerate(SECTOR_COLORS.values())
+) + "</style>"
+
+def escape_html(series):
+    """Texto de la columna escapado para HTML, con '-' en los valores vacíos"""
+    text = series.astype(object).where(series.notna(), '-').astype(str)
+    return text.str.replace('&', '&amp;').str.replace('<', '&lt;').str.replace('>', '&gt;')
+
+def format_number_series(series, prefix="", decimals=2):
+    """Versión vectorizada de format_number (sufijos T/B/M/K) para una columna entera"""
+    values = series.to_numpy(dtype=np.float64, na_value=np.nan)
+    magnitude = np.abs(values)
+    scales = [(1e12, 'T'), (1e9, 'B'), (1e6, 'M'), (1e3, 'K')]
+    conditions = [magnitude >= scale for scale, _ in scales]
+    divisor = np.select(conditions, [scale for scale, _ in scales], default=1.0)
+    suffix = np.select(conditions, [label for _, label in scales], default='')
+    text = pd.Series(np.char.mod(f'%.{decimals}f', values / divisor), index=series.index)
+    return (prefix + text + suffix).where(~np.isnan(values), '-')
+
+def html_cells(series, col):
+    """Celdas <td> de una columna completa: el formato se elige una vez por columna y se aplica vectorizado"""
+    is_number = pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series)
+    if col == 'Symbol':
+        return '<td class="bq-symbol">' + escape_html(series) + '</td>'
+    if col == 'Company Name':
+        text = series.astype(object).where(series.notna(), '-').astype(str)
+        text = text.str.slice(0, 40) + np.where(text.str.len() > 40, '...', '')
+        return '<td>' + escape_html(text) + '</td>'
+    if col == 'Country':
+        us = pd.Series(np.where(series.astype(object) == 'United States', ' bq-country-us', ''), index=series.index)
+        return '<td><span class="bq-chip bq-country' + us + '">' + escape_html(series) + '</span></td>'
+    if col == 'Sector':
+        sector_class = series.astype(object).map(
+            {sector: f' bq-sector-{i}' for i, sector in enumerate(SECTOR_COLORS)}
+        ).fillna('').astype(str)
+        return '<td><span class="bq-chip' + sector_class + '">' + escape_html(series) + '</span></td>'
+    if col == 'Market Cap' and is_number:
+        return '<td class="bq-mcap">' + format_number_series(series, prefix='$') + '</td>'
+    if 'Score' in col and is_number:
+        values = series.to_numpy(dtype=np.float64, na_value=np.nan)
+        level = np.select([values >= 75, values >= 50], ['bq-good', 'bq-mid'], default='bq-bad')
+        width = np.char.mod('%d', np.clip(np.nan_to_num(values), 0, None).astype(np.int64))
+        bars = ('<td><div class="bq-bar"><div class="' + pd.Series(level, index=series.index) + '" style="width: '
+                + width + '%"></div><span>' + np.char.mod('%.0f', values) + '</span></div></td>')
+        return bars.where(series.notna(), '<td>-</td>')
+    if is_number and any(keyword in col for keyword in PERCENT_KEYWORDS):
+        values = series.to_numpy(dtype=np.float64, na_value=np.nan)
+        sign = np.select([values > 0, values < 0], [' class="bq-pos"', ' class="bq-neg"'], default='')
+        cells = '<td' + pd.Series(sign, index=series.index) + '>' + np.char.mod('%.1f', values) + '%</td>'
+        return cells.where(series.notna(), '<td>-</td>')
+    if is_number and any(keyword in col for keyword in RATIO_KEYWORDS):
+        cells = '<td>' + pd.Series(np.char.mod('%.2f', series.to_numpy(dtype=np.float64, na_value=np.nan)),
+                                   index=series.index) + '</td>'
+        return cells.where(series.notna(), '<td>-</td>')
+    return '<td>' + escape_html(series) + '</td>'
+
+def create_beautiful_html_table(df):
+    """Crea una tabla HTML hermosa: se construye columna a columna y los estilos van en clases CSS"""
+    rows = pd.Series('<tr>', index=df.index)
+    for col in df.columns:
+        rows = rows + html_cells(df[col], col)
+    rows = rows + '</tr>'
+    headers = ''.join(f'<th>{col}</th>' for col in df.columns)
+    
+    return f"""
     <div style="border-radius: 12px; overflow: hidden; box-shadow: 0 10px 40px rgba(0,0,0,0.5); 
                 background: linear-gradient(145deg, #1a1f2e, #151922); margin-top: 20px;">
-        <style>
-            .bquant-table {{
-                width: 100%;
-                border-collapse: collapse;
-                font-family: 'Inter', -apple-system, BlinkMacSystemFont, sans-serif;
-            }}
-            .bquant-table th {{
-                background: linear-gradient(135deg, #4a9eff 0%, #3a7dd8 100%);
-                color: white;
-                padding: 14px 10px;
-                text-align: left;
-                font-weight: 600;
-                font-size: 13px;
-                text-transform: uppercase;
-                letter-spacing: 0.5px;
-                border: none;
-                position: sticky;
-                top: 0;
-                z-index: 10;
-            }}
-            .bquant-table tr {{
-                border-bottom: 1px solid rgba(74, 158, 255, 0.1);
-                transition: all 0.3s ease;
-            }}
-            .bquant-table tr:hover {{
-                background: rgba(74, 158, 255, 0.08) !important;
-                transform: scale(1.005);
-                box-shadow: 0 2px 10px rgba(74, 158, 255, 0.2);
-            }}
-            .bquant-table td {{
-                padding: 12px 10px;
-                font-size: 13px;
-            }}
-            .bquant-table tbody tr:nth-child(even) {{
-                background: rgba(74, 158, 255, 0.03);
-            }}
-        </style>
+        {HTML_TABLE_CSS}
         <table class="bquant-table">
             <thead>
                 <tr>{headers}</tr>
             </thead>
             <tbody>
-                {''.join(html_rows)}
+                {''.join(rows.tolist())}
             </tbody>
         </table>
     </div>
-    '''
-    
-    return html_table
+    """
 
 def get_available_filters_for_countries(df, countries):
     """Returns which filters have sufficient data for selected countries"""
-    if countries:
-        country_df = df[df['Country'].isin(countries)]
-    else:
-        country_df = df
+    coverage = get_coverage(get_coverage_cube(get_dataset_version(df), df), countries)
     
     # Define minimum data threshold (10% of companies must have data)
     min_coverage = 0.1
@@ -2029,24 +3330,17 @@ def get_available_filters_for_countries(df, countries):
     for group, metrics in filter_groups.items():
         available_filters[group] = []
         for metric in metrics:
-            if metric in country_df.columns:
-                coverage = country_df[metric].notna().sum() / len(country_df)
-                if coverage >= min_coverage:
-                    available_filters[group].append(metric)
+            if metric in df.columns and coverage[metric] >= min_coverage:
+                available_filters[group].append(metric)
     
     return available_filters
 
 def disable_filter_if_no_data(df, countries, metric_name):
     """Check if a metric has sufficient data for selected countries"""
-    if countries:
-        country_df = df[df['Country'].isin(countries)]
-    else:
-        country_df = df
-    
-    if metric_name not in country_df.columns:
+    if metric_name not in df.columns:
         return True  # Disable if column doesn't exist
     
-    coverage = country_df[metric_name].notna().sum() / len(country_df)
+    coverage = get_coverage(get_coverage_cube(get_dataset_version(df), df), countries)[metric_name]
     return coverage < 0.1  # Disable if less than 10% coverage
 
 # =============================================================================
@@ -2070,6 +3364,18 @@ st.markdown("""
 # Cargar datos
 with st.spinner("Cargando base de datos global..."):
     df = load_and_preprocess_data()
+    get_range_index(get_dataset_version(df), df)
+    bitmap_index = get_bitmap_index(get_dataset_version(df), df)
+    search_index = get_search_index(get_dataset_version(df), df)
+    coverage_cube = get_coverage_cube(get_dataset_version(df), df)
+    # Un CSV nuevo se prepara en segundo plano; las sesiones lo recogen en su próxima ejecución
+    refresh_dataset([get_range_index, get_bitmap_index, get_search_index, get_coverage_cube])
+
+# Una recarga fallida no se reintenta hasta que cambie el archivo: se avisa de que siguen los datos actuales
+dataset_error = get_dataset_manager()['error']
+if dataset_error:
+    st.warning(f"⚠️ No se pudo cargar el dataset más reciente ({dataset_error}). "
+               f"Se siguen mostrando los datos de {get_dataset_version(df).split(':')[0]}.")
 
 # =============================================================================
 # PANEL DE CONTROL SIMPLIFICADO - VERSIÓN CORREGIDA
@@ -2231,6 +3537,32 @@ with col6:
         help="Última actualización de datos"
     )
 
+with st.expander("🧠 Uso de Memoria del Dataset", expanded=False):
+    if st.checkbox("Calcular reporte de memoria por columna", key="show_memory_report"):
+        memory_report = build_memory_report(df)
+        original_mb = memory_report['Original (MB)'].sum()
+        compact_mb = memory_report['Compacto (MB)'].sum()
+        
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.metric("Sin compactar", f"{original_mb:,.1f} MB")
+        with col2:
+            st.metric("Compacto", f"{compact_mb:,.1f} MB")
+        with col3:
+            st.metric("Ahorro", f"{(1 - compact_mb / original_mb) * 100 if original_mb else 0:.0f}%")
+        
+        st.dataframe(
+            memory_report,
+            use_container_width=True,
+            hide_index=True,
+            column_config={
+                "Original (MB)": st.column_config.NumberColumn(format="%.2f"),
+                "Compacto (MB)": st.column_config.NumberColumn(format="%.2f"),
+                "Ahorro (MB)": st.column_config.NumberColumn(format="%.2f"),
+                "Ahorro (%)": st.column_config.ProgressColumn(min_value=0, max_value=100, format="%.0f%%")
+            }
+        )
+
 if st.session_state.filters_applied:
     active_count = len(st.session_state.get('active_filters', {}))
     screener_name = st.session_state.get('last_applied_screener', 'No definido')
@@ -2367,166 +3699,8 @@ st.markdown("---")
 
 if st.session_state.filters_applied:
     # Apply ALL filters to get accurate count
-    filtered_df = df.copy()
     active_filters = st.session_state.get('active_filters', {})
-    
-    # Apply search term
-    if 'search_term' in active_filters and active_filters['search_term']:
-        filtered_df = filtered_df[
-            filtered_df['Symbol'].str.contains(active_filters['search_term'].upper(), na=False) |
-            filtered_df['Company Name'].str.contains(active_filters['search_term'], case=False, na=False)
-        ]
-    
-    # Apply country filters
-    if 'countries' in active_filters:
-        filtered_df = filtered_df[filtered_df['Country'].isin(active_filters['countries'])]
-    if 'exclude_countries' in active_filters:
-        filtered_df = filtered_df[~filtered_df['Country'].isin(active_filters['exclude_countries'])]
-    
-    # Apply sector filters
-    if 'sectors' in active_filters and 'Sector' in filtered_df.columns:
-        filtered_df = filtered_df[filtered_df['Sector'].isin(active_filters['sectors'])]
-    
-    # Apply market cap
-    if 'market_cap_min' in active_filters and 'Market Cap' in filtered_df.columns:
-        filtered_df = filtered_df[filtered_df['Market Cap'] >= active_filters['market_cap_min']]
-    if 'market_cap_max' in active_filters and 'Market Cap' in filtered_df.columns:
-        filtered_df = filtered_df[filtered_df['Market Cap'] <= active_filters['market_cap_max']]
-    
-    # Apply ALL numeric filters
-    column_filter_mapping = {
-        'PE Ratio': {
-            'min': active_filters.get('pe_min'),
-            'max': active_filters.get('pe_max')
-        },
-        'PB Ratio': {
-            'min': active_filters.get('pb_min'),
-            'max': active_filters.get('pb_max')
-        },
-        'PS Ratio': {
-            'min': active_filters.get('ps_min'),
-            'max': active_filters.get('ps_max')
-        },
-        'PEG Ratio': {
-            'min': active_filters.get('peg_min'),
-            'max': active_filters.get('peg_max')
-        },
-        'FCF Yield': {
-            'min': active_filters.get('fcf_yield_min')
-        },
-        'Current Ratio': {
-            'min': active_filters.get('current_ratio_min')
-        },
-        'Debt / Equity': {
-            'max': active_filters.get('debt_equity_max')
-        },
-        'Z-Score': {
-            'min': active_filters.get('z_score_min')
-        },
-        'ROE': {
-            'min': active_filters.get('roe_min'),
-            'max': active_filters.get('roe_max')
-        },
-        'ROA': {
-            'min': active_filters.get('roa_min'),
-            'max': active_filters.get('roa_max')
-        },
-        'ROIC': {
-            'min': active_filters.get('roic_min'),
-            'max': active_filters.get('roic_max')
-        },
-        'Rev. Growth': {
-            'min': active_filters.get('rev_growth_min'),
-            'max': active_filters.get('rev_growth_max')
-        },
-        'EPS Growth': {
-            'min': active_filters.get('eps_growth_min'),
-            'max': active_filters.get('eps_growth_max')
-        },
-        'Profit Margin': {
-            'min': active_filters.get('profit_margin_min'),
-            'max': active_filters.get('profit_margin_max')
-        },
-        'Gross Margin': {
-            'min': active_filters.get('gross_margin_min'),
-            'max': active_filters.get('gross_margin_max')
-        },
-        'Years': {
-            'min': active_filters.get('years_min'),
-            'max': active_filters.get('years_max')
-        },
-        'Div. Yield': {
-            'min': active_filters.get('div_yield_min'),
-            'max': active_filters.get('div_yield_max')
-        },
-        'Payout Ratio': {
-            'min': active_filters.get('payout_ratio_min'),
-            'max': active_filters.get('payout_ratio_max')
-        },
-        'RSI': {
-            'min': active_filters.get('rsi_min'),
-            'max': active_filters.get('rsi_max')
-        },
-        'Beta (5Y)': {
-            'min': active_filters.get('beta_min'),
-            'max': active_filters.get('beta_max')
-        },
-        'Return 1Y': {
-            'min': active_filters.get('return_1y_min'),
-            'max': active_filters.get('return_1y_max')
-        },
-        'Return 3M': {
-            'min': active_filters.get('return_3m_min'),
-            'max': active_filters.get('return_3m_max')
-        },
-        'Return 6M': {
-            'min': active_filters.get('return_6m_min'),
-            'max': active_filters.get('return_6m_max')
-        },
-        'Rel. Volume': {
-            'min': active_filters.get('rel_volume_min'),
-            'max': active_filters.get('rel_volume_max')
-        },
-        'Shares Insiders': {
-            'min': active_filters.get('insider_ownership_min'),
-            'max': active_filters.get('insider_ownership_max')
-        },
-        'Shares Institut.': {
-            'min': active_filters.get('institutional_ownership_min'),
-            'max': active_filters.get('institutional_ownership_max')
-        },
-        'Quality_Score': {
-            'min': active_filters.get('quality_score_min')
-        },
-        'Value_Score': {
-            'min': active_filters.get('value_score_min')
-        },
-        'Growth_Score': {
-            'min': active_filters.get('growth_score_min')
-        },
-        'Financial_Health_Score': {
-            'min': active_filters.get('financial_health_score_min')
-        },
-        'Momentum_Score': {
-            'min': active_filters.get('momentum_score_min')
-        },
-        'Master_Score': {
-            'min': active_filters.get('master_score_min')
-        }
-    }
-    
-    # Apply all numeric filters
-    for col, limits in column_filter_mapping.items():
-        if col in filtered_df.columns:
-            if 'min' in limits and limits['min'] is not None:
-                filtered_df = filtered_df[filtered_df[col] >= limits['min']]
-            if 'max' in limits and limits['max'] is not None:
-                filtered_df = filtered_df[filtered_df[col] <= limits['max']]
-    
-    # Special handling for 52W High distance
-    if 'distance_52w_high_max' in active_filters and '52W High Chg' in filtered_df.columns:
-        max_distance = -active_filters['distance_52w_high_max']
-        filtered_df = filtered_df[filtered_df['52W High Chg'] >= max_distance]
+    filtered_df = apply_filters(df, active_filters)
     
     # Calculate metrics from the fully filtered dataframe
     results_count = len(filtered_df)
@@ -2660,6 +3834,13 @@ with main_tab1:
     </div>
     """, unsafe_allow_html=True)
     
+    # Recuento en vivo con los valores pendientes (antes de pulsar EJECUTAR)
+    pending_filters = capture_current_filter_values()
+    render_pending_counts(compute_pending_counts(df, pending_filters))
+    if st.toggle("📉 Sensibilidad de umbrales", key="show_threshold_sensitivity",
+                 help="Resultados según se mueve cada umbral, con el resto de filtros fijos"):
+        render_threshold_sensitivity(df, pending_filters)
+    
     # Categorías de filtros en tabs
     filter_tabs = st.tabs([
         "🔍 Básicos", "🌍 Países", "📊 Valoración", "📈 Crecimiento", 
@@ -2676,18 +3857,12 @@ with main_tab1:
         
         col1, col2, col3, col4 = st.columns(4)
         with col1:
-            search_term = st.text_input(
-                "🔎 Buscar", 
-                placeholder="Ticker o nombre",
-                key="search_term",
-                on_change=mark_filters_as_modified,
-                help="Buscar por símbolo o nombre de empresa"
-            )
+            search_term = render_search_box(df, search_index)
         with col2:
             if 'Sector' in df.columns:
                 sectors_filter = st.multiselect(
                     "🏢 Sectores",
-                    options=sorted(df['Sector'].dropna().unique()),
+                    options=sorted(bitmap_index['columns']['Sector']),
                     default=preset_filters.get('sectors', []),
                     key="sectors_filter",
                     on_change=mark_filters_as_modified,
@@ -2735,7 +3910,7 @@ with main_tab1:
             if 'Exchange' in df.columns:
                 exchanges_filter = st.multiselect(
                     "🏛️ Bolsas",
-                    options=sorted(df['Exchange'].dropna().unique()),
+                    options=sorted(bitmap_index['columns']['Exchange']),
                     key="exchanges_filter",
                     on_change=mark_filters_as_modified,
                     help=METRIC_DESCRIPTIONS["exchange"]
@@ -2756,7 +3931,7 @@ with main_tab1:
             if 'Industry' in df.columns:
                 industries_filter = st.multiselect(
                     "🏭 Industrias",
-                    options=sorted(df['Industry'].dropna().unique()),
+                    options=sorted(bitmap_index['columns']['Industry']),
                     key="industries_filter",
                     on_change=mark_filters_as_modified,
                     help=METRIC_DESCRIPTIONS["industry"]
@@ -2765,7 +3940,7 @@ with main_tab1:
             if 'MC Group' in df.columns:
                 mc_groups_filter = st.multiselect(
                     "📊 Grupo Cap.",
-                    options=sorted(df['MC Group'].dropna().unique()),
+                    options=sorted(bitmap_index['columns']['MC Group']),
                     key="mc_groups_filter",
                     on_change=mark_filters_as_modified,
                     help=METRIC_DESCRIPTIONS["mc_group"]
@@ -2796,7 +3971,7 @@ with main_tab1:
     with filter_tabs[1]:
         st.markdown('<div class="filter-section">', unsafe_allow_html=True)
         if 'Country' in df.columns:
-            country_counts = df['Country'].value_counts()
+            country_counts = facet_counts(bitmap_index, 'Country')
             
             st.markdown('<div class="section-header">🌍 Filtros Geográficos</div>', unsafe_allow_html=True)
             
@@ -2916,14 +4091,14 @@ with main_tab1:
                 
                 # Get the dataframe for selected countries
                 if filter_mode == "Incluir Países" and countries_filter:
-                    selected_countries_df = df[df['Country'].isin(countries_filter)]
+                    selected_coverage = get_coverage(coverage_cube, countries_filter)
                     selected_countries_list = countries_filter
                 elif filter_mode == "Excluir Países" and exclude_countries:
-                    selected_countries_df = df[~df['Country'].isin(exclude_countries)]
-                    selected_countries_list = [c for c in df['Country'].unique() if c not in exclude_countries]
+                    selected_coverage = get_coverage(coverage_cube, exclude_countries, exclude=True)
+                    selected_countries_list = [c for c in country_counts.index if c not in exclude_countries]
                 else:
-                    selected_countries_df = df
-                    selected_countries_list = list(df['Country'].unique())
+                    selected_coverage = get_coverage(coverage_cube)
+                    selected_countries_list = list(country_counts.index)
                 
                 # Calculate detailed coverage metrics
                 coverage_categories = {
@@ -2940,15 +4115,11 @@ with main_tab1:
                 missing_categories = []
                 
                 for category, metrics in coverage_categories.items():
-                    available_count = 0
-                    total_data_points = 0
-                    
-                    for metric in metrics:
-                        if metric in selected_countries_df.columns:
-                            non_null = selected_countries_df[metric].notna().sum()
-                            total_data_points += non_null
-                            if non_null > len(selected_countries_df) * 0.1:  # At least 10% coverage
-                                available_count += 1
+                    # Métricas con al menos un 10% de cobertura
+                    available_count = sum(
+                        1 for metric in metrics
+                        if metric in selected_coverage.index and selected_coverage[metric] > 0.1
+                    )
                     
                     if len(metrics) > 0:
                         coverage_pct = (available_count / len(metrics)) * 100
@@ -3101,7 +4272,7 @@ with main_tab1:
         
         if 'countries_filter' in st.session_state and st.session_state.countries_filter:
             # Get data for selected countries
-            selected_df = df[df['Country'].isin(st.session_state.countries_filter)]
+            selected_coverage = get_coverage(coverage_cube, st.session_state.countries_filter)
             
             # Check each valuation metric
             valuation_metrics = {
@@ -3127,8 +4298,8 @@ with main_tab1:
             }
             
             for metric, display_name in valuation_metrics.items():
-                if metric in selected_df.columns:
-                    coverage = (selected_df[metric].notna().sum() / len(selected_df)) * 100
+                if metric in selected_coverage.index:
+                    coverage = selected_coverage[metric] * 100
                     if coverage >= 10:
                         available_valuation_metrics.append((metric, display_name, coverage))
                     else:
@@ -3915,417 +5086,7 @@ Master Score = (Calidad × 30%) + (Valor × 25%) + (Crecimiento × 20%) +
 # =============================================================================
 
 if st.session_state.filters_applied:
-    filtered_df = df.copy()
-    
-    # Obtener los filtros activos del session_state
-    active_filters = st.session_state.get('active_filters', {})
-    
-    # Aplicar búsqueda de texto
-    if 'search_term' in active_filters and active_filters['search_term']:
-        filtered_df = filtered_df[
-            filtered_df['Symbol'].str.contains(active_filters['search_term'].upper(), na=False) |
-            filtered_df['Company Name'].str.contains(active_filters['search_term'], case=False, na=False)
-        ]
-    
-    # Aplicar filtros de países
-    if 'countries' in active_filters:
-        filtered_df = filtered_df[filtered_df['Country'].isin(active_filters['countries'])]
-    if 'exclude_countries' in active_filters:
-        filtered_df = filtered_df[~filtered_df['Country'].isin(active_filters['exclude_countries'])]
-    
-    # Aplicar filtros de sectores
-    if 'sectors' in active_filters and 'Sector' in filtered_df.columns:
-        filtered_df = filtered_df[filtered_df['Sector'].isin(active_filters['sectors'])]
-    
-    # Aplicar market cap
-    if 'market_cap_min' in active_filters and 'Market Cap' in filtered_df.columns:
-        filtered_df = filtered_df[filtered_df['Market Cap'] >= active_filters['market_cap_min']]
-    if 'market_cap_max' in active_filters and 'Market Cap' in filtered_df.columns:
-        filtered_df = filtered_df[filtered_df['Market Cap'] <= active_filters['market_cap_max']]
-    
-    # Mapeo completo de filtros a columnas
-    column_filter_mapping = {
-        # Valoración
-        'PE Ratio': {
-            'min': active_filters.get('pe_min'),
-            'max': active_filters.get('pe_max')
-        },
-        'Forward PE': {
-            'min': active_filters.get('forward_pe_min'),
-            'max': active_filters.get('forward_pe_max')
-        },
-        'PB Ratio': {
-            'min': active_filters.get('pb_min'),
-            'max': active_filters.get('pb_max')
-        },
-        'PS Ratio': {
-            'min': active_filters.get('ps_min'),
-            'max': active_filters.get('ps_max')
-        },
-        'Forward PS': {
-            'min': active_filters.get('forward_ps_min'),
-            'max': active_filters.get('forward_ps_max')
-        },
-        'PEG Ratio': {
-            'min': active_filters.get('peg_min'),
-            'max': active_filters.get('peg_max')
-        },
-        'P/FCF': {
-            'min': active_filters.get('p_fcf_min'),
-            'max': active_filters.get('p_fcf_max')
-        },
-        'P/OCF': {
-            'min': active_filters.get('p_ocf_min'),
-            'max': active_filters.get('p_ocf_max')
-        },
-        'P/EBITDA': {
-            'min': active_filters.get('p_ebitda_min'),
-            'max': active_filters.get('p_ebitda_max')
-        },
-        
-        # Enterprise Value
-        'EV/Sales': {
-            'min': active_filters.get('ev_sales_min'),
-            'max': active_filters.get('ev_sales_max')
-        },
-        'EV/EBITDA': {
-            'min': active_filters.get('ev_ebitda_min'),
-            'max': active_filters.get('ev_ebitda_max')
-        },
-        'EV/EBIT': {
-            'min': active_filters.get('ev_ebit_min'),
-            'max': active_filters.get('ev_ebit_max')
-        },
-        'EV/FCF': {
-            'min': active_filters.get('ev_fcf_min'),
-            'max': active_filters.get('ev_fcf_max')
-        },
-        
-        # Yields
-        'FCF Yield': {
-            'min': active_filters.get('fcf_yield_min')
-        },
-        'Earnings Yield': {
-            'min': active_filters.get('earnings_yield_min')
-        },
-        'Graham (%)': {
-            'min': active_filters.get('graham_upside_min')
-        },
-        'Lynch (%)': {
-            'min': active_filters.get('lynch_upside_min')
-        },
-        
-        # Crecimiento
-        'Rev. Growth': {
-            'min': active_filters.get('rev_growth_min'),
-            'max': active_filters.get('rev_growth_max')
-        },
-        'Rev. Growth (Q)': {
-            'min': active_filters.get('rev_growth_q_min'),
-            'max': active_filters.get('rev_growth_q_max')
-        },
-        'Rev. Growth 3Y': {
-            'min': active_filters.get('rev_growth_3y_min')
-        },
-        'Rev. Growth 5Y': {
-            'min': active_filters.get('rev_growth_5y_min')
-        },
-        'EPS Growth': {
-            'min': active_filters.get('eps_growth_min'),
-            'max': active_filters.get('eps_growth_max')
-        },
-        'EPS Growth (Q)': {
-            'min': active_filters.get('eps_growth_q_min'),
-            'max': active_filters.get('eps_growth_q_max')
-        },
-        'EPS Growth 3Y': {
-            'min': active_filters.get('eps_growth_3y_min')
-        },
-        'EPS Growth 5Y': {
-            'min': active_filters.get('eps_growth_5y_min')
-        },
-        'Rev Gr. This Y': {
-            'min': active_filters.get('rev_gr_this_y_min')
-        },
-        'Rev Gr. Next Y': {
-            'min': active_filters.get('rev_gr_next_y_min')
-        },
-        'EPS Gr. This Y': {
-            'min': active_filters.get('eps_gr_this_y_min')
-        },
-        'EPS Gr. Next Y': {
-            'min': active_filters.get('eps_gr_next_y_min')
-        },
-        'FCF Growth': {
-            'min': active_filters.get('fcf_growth_min')
-        },
-        
-        # Rentabilidad
-        'ROE': {
-            'min': active_filters.get('roe_min'),
-            'max': active_filters.get('roe_max')
-        },
-        'ROA': {
-            'min': active_filters.get('roa_min'),
-            'max': active_filters.get('roa_max')
-        },
-        'ROIC': {
-            'min': active_filters.get('roic_min'),
-            'max': active_filters.get('roic_max')
-        },
-        'ROCE': {
-            'min': active_filters.get('roce_min'),
-            'max': active_filters.get('roce_max')
-        },
-        'ROE (5Y)': {
-            'min': active_filters.get('roe_5y_min')
-        },
-        'ROA (5Y)': {
-            'min': active_filters.get('roa_5y_min')
-        },
-        'ROIC (5Y)': {
-            'min': active_filters.get('roic_5y_min')
-        },
-        
-        # Márgenes
-        'Gross Margin': {
-            'min': active_filters.get('gross_margin_min'),
-            'max': active_filters.get('gross_margin_max')
-        },
-        'Oper. Margin': {
-            'min': active_filters.get('operating_margin_min'),
-            'max': active_filters.get('operating_margin_max')
-        },
-        'Pretax Margin': {
-            'min': active_filters.get('pretax_margin_min'),
-            'max': active_filters.get('pretax_margin_max')
-        },
-        'Profit Margin': {
-            'min': active_filters.get('profit_margin_min'),
-            'max': active_filters.get('profit_margin_max')
-        },
-        'FCF Margin': {
-            'min': active_filters.get('fcf_margin_min'),
-            'max': active_filters.get('fcf_margin_max')
-        },
-        'EBITDA Margin': {
-            'min': active_filters.get('ebitda_margin_min'),
-            'max': active_filters.get('ebitda_margin_max')
-        },
-        'EBIT Margin': {
-            'min': active_filters.get('ebit_margin_min'),
-            'max': active_filters.get('ebit_margin_max')
-        },
-        
-        # Salud Financiera
-        'Current Ratio': {
-            'min': active_filters.get('current_ratio_min'),
-            'max': active_filters.get('current_ratio_max')
-        },
-        'Quick Ratio': {
-            'min': active_filters.get('quick_ratio_min'),
-            'max': active_filters.get('quick_ratio_max')
-        },
-        'Debt / Equity': {
-            'min': active_filters.get('debt_equity_min'),
-            'max': active_filters.get('debt_equity_max')
-        },
-        'Debt / EBITDA': {
-            'min': active_filters.get('debt_ebitda_min'),
-            'max': active_filters.get('debt_ebitda_max')
-        },
-        'Debt / FCF': {
-            'min': active_filters.get('debt_fcf_min'),
-            'max': active_filters.get('debt_fcf_max')
-        },
-        'Z-Score': {
-            'min': active_filters.get('z_score_min'),
-            'max': active_filters.get('z_score_max')
-        },
-        'F-Score': {
-            'min': active_filters.get('f_score_min'),
-            'max': active_filters.get('f_score_max')
-        },
-        'Int. Cov.': {
-            'min': active_filters.get('interest_coverage_min'),
-            'max': active_filters.get('interest_coverage_max')
-        },
-        'FCF': {
-            'min': active_filters.get('fcf_min'),
-            'max': active_filters.get('fcf_max')
-        },
-        
-        # Dividendos
-        'Years': {
-            'min': active_filters.get('years_min'),
-            'max': active_filters.get('years_max')
-        },
-        'Div. Yield': {
-            'min': active_filters.get('div_yield_min'),
-            'max': active_filters.get('div_yield_max')
-        },
-        'Payout Ratio': {
-            'min': active_filters.get('payout_ratio_min'),
-            'max': active_filters.get('payout_ratio_max')
-        },
-        'Div. Growth': {
-            'min': active_filters.get('div_growth_1y_min'),
-            'max': active_filters.get('div_growth_1y_max')
-        },
-        'Div. Growth 3Y': {
-            'min': active_filters.get('div_growth_3y_min'),
-            'max': active_filters.get('div_growth_3y_max')
-        },
-        'Div. Growth 5Y': {
-            'min': active_filters.get('div_growth_5y_min'),
-            'max': active_filters.get('div_growth_5y_max')
-        },
-        'Div. Growth 10Y': {
-            'min': active_filters.get('div_growth_10y_min'),
-            'max': active_filters.get('div_growth_10y_max')
-        },
-        'Shareh. Yield': {
-            'min': active_filters.get('shareholder_yield_min'),
-            'max': active_filters.get('shareholder_yield_max')
-        },
-        'Buyback Yield': {
-            'min': active_filters.get('buyback_yield_min'),
-            'max': active_filters.get('buyback_yield_max')
-        },
-        
-        # Técnico - Retornos
-        'Return 1W': {
-            'min': active_filters.get('return_1w_min'),
-            'max': active_filters.get('return_1w_max')
-        },
-        'Return 1M': {
-            'min': active_filters.get('return_1m_min'),
-            'max': active_filters.get('return_1m_max')
-        },
-        'Return 3M': {
-            'min': active_filters.get('return_3m_min'),
-            'max': active_filters.get('return_3m_max')
-        },
-        'Return 6M': {
-            'min': active_filters.get('return_6m_min'),
-            'max': active_filters.get('return_6m_max')
-        },
-        'Return YTD': {
-            'min': active_filters.get('return_ytd_min'),
-            'max': active_filters.get('return_ytd_max')
-        },
-        'Return 1Y': {
-            'min': active_filters.get('return_1y_min'),
-            'max': active_filters.get('return_1y_max')
-        },
-        'Return 3Y': {
-            'min': active_filters.get('return_3y_min'),
-            'max': active_filters.get('return_3y_max')
-        },
-        'Return 5Y': {
-            'min': active_filters.get('return_5y_min'),
-            'max': active_filters.get('return_5y_max')
-        },
-        'Return 10Y': {
-            'min': active_filters.get('return_10y_min'),
-            'max': active_filters.get('return_10y_max')
-        },
-        
-        # Técnico - Indicadores
-        'RSI': {
-            'min': active_filters.get('rsi_min'),
-            'max': active_filters.get('rsi_max')
-        },
-        'RSI (W)': {
-            'min': active_filters.get('rsi_w_min'),
-            'max': active_filters.get('rsi_w_max')
-        },
-        'RSI (M)': {
-            'min': active_filters.get('rsi_m_min'),
-            'max': active_filters.get('rsi_m_max')
-        },
-        'Beta (5Y)': {
-            'min': active_filters.get('beta_min'),
-            'max': active_filters.get('beta_max')
-        },
-        'ATR': {
-            'min': active_filters.get('atr_min'),
-            'max': active_filters.get('atr_max')
-        },
-        'Rel. Volume': {
-            'min': active_filters.get('rel_volume_min'),
-            'max': active_filters.get('rel_volume_max')
-        },
-        
-        # Propiedad
-        'Employees': {
-            'min': active_filters.get('employees_min')
-        },
-        'Founded': {
-            'min': active_filters.get('founded_after')
-        },
-        'Shares Insiders': {
-            'min': active_filters.get('insider_ownership_min'),
-            'max': active_filters.get('insider_ownership_max')
-        },
-        'Shares Institut.': {
-            'min': active_filters.get('institutional_ownership_min'),
-            'max': active_filters.get('institutional_ownership_max')
-        },
-        'Analysts': {
-            'min': active_filters.get('analysts_min'),
-            'max': active_filters.get('analysts_max')
-        },
-        'Short % Float': {
-            'min': active_filters.get('short_float_min'),
-            'max': active_filters.get('short_float_max')
-        },
-        'Short % Shares': {
-            'min': active_filters.get('short_shares_min'),
-            'max': active_filters.get('short_shares_max')
-        },
-        'Short Ratio': {
-            'min': active_filters.get('short_ratio_min'),
-            'max': active_filters.get('short_ratio_max')
-        },
-        
-        # Scores
-        'Quality_Score': {
-            'min': active_filters.get('quality_score_min')
-        },
-        'Value_Score': {
-            'min': active_filters.get('value_score_min')
-        },
-        'Growth_Score': {
-            'min': active_filters.get('growth_score_min')
-        },
-        'Financial_Health_Score': {
-            'min': active_filters.get('financial_health_score_min')
-        },
-        'Momentum_Score': {
-            'min': active_filters.get('momentum_score_min')
-        },
-        'Master_Score': {
-            'min': active_filters.get('master_score_min')
-        }
-    }
-    
-    # Aplicar todos los filtros numéricos
-    for col, limits in column_filter_mapping.items():
-        if col in filtered_df.columns:
-            if 'min' in limits and limits['min'] is not None:
-                filtered_df = filtered_df[filtered_df[col] >= limits['min']]
-            if 'max' in limits and limits['max'] is not None:
-                filtered_df = filtered_df[filtered_df[col] <= limits['max']]
-    
-    # Manejo especial para distancia desde máximo 52 semanas
-    if 'distance_52w_high_max' in active_filters and '52W High Chg' in filtered_df.columns:
-        max_distance = -active_filters['distance_52w_high_max']
-        filtered_df = filtered_df[filtered_df['52W High Chg'] >= max_distance]
-    
-    # Manejo especial para distancia desde mínimo 52 semanas
-    if 'distance_52w_low_min' in active_filters and '52W Low Chg' in filtered_df.columns:
-        filtered_df = filtered_df[filtered_df['52W Low Chg'] >= active_filters['distance_52w_low_min']]
+    # filtered_df ya se calculó una sola vez con apply_filters() en la vista previa de resultados
     
     # Mostrar resultados
     with main_tab2:
@@ -4335,12 +5096,8 @@ if st.session_state.filters_applied:
             # Calculate data completeness for filtered results
             key_metrics = ['PE Ratio', 'ROE', 'Rev. Growth', 'Div. Yield', 'Beta (5Y)', 
                         'Forward PE', 'Analysts', 'EPS Growth', 'Profit Margin']
-            completeness_scores = {}
-            
-            for metric in key_metrics:
-                if metric in filtered_df.columns:
-                    completeness = (filtered_df[metric].notna().sum() / len(filtered_df)) * 100
-                    completeness_scores[metric] = completeness
+            available_key_metrics = [metric for metric in key_metrics if metric in filtered_df.columns]
+            completeness_scores = (filtered_df[available_key_metrics].notna().mean() * 100).to_dict()
             
             avg_completeness = sum(completeness_scores.values()) / len(completeness_scores) if completeness_scores else 0
             
@@ -4421,14 +5178,21 @@ if st.session_state.filters_applied:
             
             # ===== RESULTS TABS =====
             st.markdown('<div id="results-anchor"></div>', unsafe_allow_html=True)
-            result_tabs = st.tabs([
-                "📊 Tabla", "📈 Gráficos", "🏆 Rankings", 
-                "🎯 Análisis Sectorial", "🌍 Análisis por País", 
-                "📐 Correlaciones", "💾 Exportar"
-            ])
+            # Solo se ejecuta el panel seleccionado; cada panel es un fragmento aislado.
+            # Sus widgets guardan el valor con remember_selection para no perderlo al cambiar de panel
+            selected_panel = st.radio(
+                "Vista de resultados",
+                ["📊 Tabla", "🎯 Casi Cumplen", "📈 Gráficos", "🏆 Rankings",
+                 "🎯 Análisis Sectorial", "🌍 Análisis por País",
+                 "📐 Correlaciones", "💾 Exportar"],
+                horizontal=True,
+                label_visibility="collapsed",
+                key="result_panel"
+            )
             
             # TAB 1: TABLA
-            with result_tabs[0]:
+            @st.fragment
+            def render_table_panel(filtered_df):
                 st.markdown("### 📊 Resultados del Screening")
                 
                 # Initialize column selection in session state if not exists
@@ -4482,7 +5246,7 @@ if st.session_state.filters_applied:
                         
                         with col3:
                             n_rows = st.select_slider(
-                                "Filas a mostrar:",
+                                "Filas por página:",
                                 options=[25, 50, 100, 200, 500, 1000],
                                 value=st.session_state.n_rows_display,
                                 key="temp_n_rows"
@@ -4498,6 +5262,9 @@ if st.session_state.filters_applied:
                         if submitted:
                             # Update state and scroll back to results
                             st.session_state.selected_columns_display = selected_columns
+                            st.session_state.sort_column = sort_column
+                            st.session_state.sort_order = sort_order
+                            st.session_state.n_rows_display = n_rows
                             st.rerun()
                             # Use JavaScript to scroll back
                             st.markdown("""
@@ -4508,11 +5275,18 @@ if st.session_state.filters_applied:
                 
                 # Display table with current configuration
                 if st.session_state.selected_columns_display:
-                    df_display = filtered_df[st.session_state.selected_columns_display].copy()
-                    df_display = df_display.sort_values(
-                        by=st.session_state.sort_column, 
-                        ascending=(st.session_state.sort_order == "Ascendente")
-                    ).head(st.session_state.n_rows_display)
+                    # Solo se materializa y envía al navegador la página actual
+                    ascending = st.session_state.sort_order == "Ascendente"
+                    fingerprint = filter_fingerprint(active_filters)
+                    sorted_positions = get_sorted_positions(
+                        fingerprint, get_dataset_version(df), st.session_state.sort_column,
+                        ascending, df, active_filters
+                    )
+                    page_positions = render_pagination(
+                        sorted_positions, search_index['symbols'], st.session_state.n_rows_display, "results_page",
+                        view=(fingerprint, st.session_state.sort_column, ascending, st.session_state.n_rows_display)
+                    )
+                    df_display = df.iloc[page_positions][st.session_state.selected_columns_display]
                     
                     # Option 1: Use st.dataframe (interactive but simpler)
                     st.dataframe(
@@ -4564,20 +5338,31 @@ if st.session_state.filters_applied:
                         }
                     )
                     
-                    if st.checkbox("🔒 Lock View (prevent auto-refresh)", key="lock_view"):
+                    if st.checkbox("🔒 Lock View (prevent auto-refresh)", value=saved_selection("lock_view", False),
+                                   key="lock_view", on_change=remember_selection, args=("lock_view",)):
                         html_table = create_beautiful_html_table(df_display)
                         st.markdown(html_table, unsafe_allow_html=True)
             
-            with result_tabs[1]:
+            # TAB 2: CASI CUMPLEN
+            @st.fragment
+            def render_near_miss_panel(filtered_df):
+                st.markdown("### 🎯 Acciones que Casi Cumplen")
+                render_near_misses(df, active_filters, "results")
+            
+            # TAB 3: GRÁFICOS
+            @st.fragment
+            def render_charts_panel(filtered_df):
                 st.markdown("### 📈 Análisis Visual")
                 
                 if len(filtered_df) > 1:
+                    # Las 500 mejores por puntuación para los gráficos de dispersión
+                    chart_df = top_k(filtered_df, 'Master_Score', 500) if 'Master_Score' in filtered_df.columns else filtered_df.head(500)
                     col1, col2 = st.columns(2)
                     
                     with col1:
                         st.markdown("##### Matriz Valor vs Calidad")
                         fig = px.scatter(
-                            filtered_df.head(500),
+                            chart_df,
                             x='Value_Score',
                             y='Quality_Score',
                             size='Market Cap',
@@ -4593,7 +5378,7 @@ if st.session_state.filters_applied:
                     with col2:
                         st.markdown("##### Matriz Crecimiento vs Momentum")
                         fig = px.scatter(
-                            filtered_df.head(500),
+                            chart_df,
                             x='Growth_Score',
                             y='Momentum_Score',
                             size='Market Cap',
@@ -4633,74 +5418,43 @@ if st.session_state.filters_applied:
                 else:
                     st.warning("⚠️ Se necesitan al menos 2 resultados para visualización")
             
-            # TAB 3: RANKINGS
-            with result_tabs[2]:
+            # TAB 4: RANKINGS
+            @st.fragment
+            def render_rankings_panel(filtered_df):
                 st.markdown("### 🏆 Rankings por Categoría")
                 
-                col1, col2, col3 = st.columns(3)
-                
+                col1, col2 = st.columns([3, 1])
                 with col1:
-                    render_ranking_card(
-                        "Top Valor", "💎", filtered_df,
-                        'Value_Score', 'PE Ratio', 'P/E', "{:.1f}"
-                    )
-                    
-                    st.markdown("---")
-                    
-                    render_ranking_card(
-                        "Top Dividendos", "💰", 
-                        filtered_df[filtered_df['Div. Yield'] > 0] if 'Div. Yield' in filtered_df.columns else filtered_df,
-                        'Div. Yield', 'Payout Ratio', 'Payout', "{:.1f}%"
+                    ranking_options = [card['title'] for card in RANKING_CARDS]
+                    ranking_titles = st.multiselect(
+                        "Categorías:",
+                        options=ranking_options,
+                        default=saved_selection("ranking_titles", DEFAULT_RANKING_CARDS, ranking_options),
+                        key="ranking_titles",
+                        on_change=remember_selection,
+                        args=("ranking_titles",)
                     )
-                
                 with col2:
-                    render_ranking_card(
-                        "Top Crecimiento", "🚀", filtered_df,
-                        'Growth_Score', 'Rev. Growth', 'Crecimiento Ingresos', "{:.1f}%"
-                    )
-                    
-                    st.markdown("---")
-                    
-                    render_ranking_card(
-                        "Top Momentum", "📈", filtered_df,
-                        'Momentum_Score', 'Return 1Y', 'Retorno 1A', "{:.1f}%"
-                    )
-                
-                with col3:
-                    render_ranking_card(
-                        "Top Calidad", "⭐", filtered_df,
-                        'Quality_Score', 'ROE', 'ROE', "{:.1f}%"
-                    )
-                    
-                    st.markdown("---")
-                    
-                    render_ranking_card(
-                        "Top Salud Financiera", "🏥", filtered_df,
-                        'Financial_Health_Score', 'Current Ratio', 'Ratio Corriente', "{:.2f}"
+                    ranking_count = st.select_slider(
+                        "Resultados por ranking:",
+                        options=[5, 10, 15, 20, 25],
+                        value=saved_selection("ranking_count", 10, [5, 10, 15, 20, 25]),
+                        key="ranking_count",
+                        on_change=remember_selection,
+                        args=("ranking_count",)
                     )
+                render_ranking_cards(filtered_df, ranking_titles, ranking_count)
             
-            # TAB 4: ANÁLISIS SECTORIAL
-            with result_tabs[3]:
+            # TAB 5: ANÁLISIS SECTORIAL
+            @st.fragment
+            def render_sector_panel(filtered_df):
                 st.markdown("### 🎯 Análisis Sectorial Detallado")
                 
                 if 'Sector' in filtered_df.columns:
-                    # Métricas por sector
-                    sector_metrics = filtered_df.groupby('Sector').agg({
-                        'Symbol': 'count',
-                        'Market Cap': ['sum', 'mean', 'median'],
-                        'PE Ratio': 'median',
-                        'ROE': 'median',
-                        'Rev. Growth': 'median',
-                        'Profit Margin': 'median',
-                        'Debt / Equity': 'median',
-                        'Return 1Y': 'median',
-                        'Master_Score': 'mean'
-                    }).round(2)
-                    
-                    sector_metrics.columns = ['Acciones', 'Cap. Total', 'Cap. Media', 'Cap. Mediana',
-                                            'P/E Med', 'ROE Med', 'Crec. Ingresos Med', 
-                                            'Margen Neto Med', 'D/E Med', 'Retorno 1A Med', 'Score Promedio']
-                    sector_metrics = sector_metrics.sort_values('Acciones', ascending=False)
+                    # Métricas por sector (cacheadas por huella de filtros)
+                    sector_metrics, heatmap_df = get_sector_summary(
+                        filter_fingerprint(active_filters), get_dataset_version(df), filtered_df
+                    )
                     
                     # Formatear valores
                     for col in ['Cap. Total', 'Cap. Media', 'Cap. Mediana']:
@@ -4733,8 +5487,8 @@ if st.session_state.filters_applied:
                     with col1:
                         # Pie chart de distribución
                         fig = px.pie(
-                            values=filtered_df.groupby('Sector')['Symbol'].count().values,
-                            names=filtered_df.groupby('Sector')['Symbol'].count().index,
+                            values=sector_metrics['Acciones'].values,
+                            names=sector_metrics.index,
                             title="Distribución por Sector",
                             template='plotly_dark'
                         )
@@ -4743,7 +5497,7 @@ if st.session_state.filters_applied:
                     
                     with col2:
                         # Bar chart de performance
-                        sector_perf = filtered_df.groupby('Sector')['Master_Score'].mean().sort_values()
+                        sector_perf = sector_metrics['Score Promedio'].sort_values()
                         fig = px.bar(
                             x=sector_perf.values,
                             y=sector_perf.index,
@@ -4757,25 +5511,12 @@ if st.session_state.filters_applied:
                     
                     # Heatmap de métricas por sector
                     st.markdown("##### Mapa de Calor - Métricas por Sector")
-                    metrics_for_heatmap = ['ROE', 'ROA', 'Profit Margin', 'Rev. Growth', 'Return 1Y']
-                    heatmap_data = []
-                    
-                    for sector in filtered_df['Sector'].unique():
-                        sector_data = []
-                        for metric in metrics_for_heatmap:
-                            if metric in filtered_df.columns:
-                                value = filtered_df[filtered_df['Sector'] == sector][metric].median()
-                                sector_data.append(value)
-                            else:
-                                sector_data.append(0)
-                        heatmap_data.append(sector_data)
-                    
                     fig = go.Figure(data=go.Heatmap(
-                        z=heatmap_data,
-                        x=metrics_for_heatmap,
-                        y=filtered_df['Sector'].unique(),
+                        z=heatmap_df.values,
+                        x=list(heatmap_df.columns),
+                        y=list(heatmap_df.index),
                         colorscale='RdYlGn',
-                        text=np.round(heatmap_data, 1),
+                        text=np.round(heatmap_df.values.astype(float), 1),
                         texttemplate='%{text}',
                         textfont={"size": 10},
                         colorbar=dict(title="Valor")
@@ -4790,24 +5531,16 @@ if st.session_state.filters_applied:
                 else:
                     st.info("No hay datos de sector disponibles")
             
-            # TAB 5: ANÁLISIS POR PAÍS
-            with result_tabs[4]:
+            # TAB 6: ANÁLISIS POR PAÍS
+            @st.fragment
+            def render_country_panel(filtered_df):
                 st.markdown("### 🌍 Análisis Geográfico")
                 
                 if 'Country' in filtered_df.columns:
                     # Métricas por país
-                    country_metrics = filtered_df.groupby('Country').agg({
-                        'Symbol': 'count',
-                        'Market Cap': 'sum',
-                        'Master_Score': 'mean',
-                        'PE Ratio': 'median',
-                        'ROE': 'median',
-                        'Return 1Y': 'median'
-                    }).round(2)
-                    
-                    country_metrics.columns = ['Acciones', 'Cap. Total', 'Score Prom', 
-                                            'P/E Med', 'ROE Med', 'Ret. 1A Med']
-                    country_metrics = country_metrics.sort_values('Acciones', ascending=False)
+                    country_metrics = get_country_summary(
+                        filter_fingerprint(active_filters), get_dataset_version(df), filtered_df
+                    )
                     
                     # Top 20 países
                     st.markdown("##### Top 20 Países por Número de Acciones")
@@ -4846,8 +5579,9 @@ if st.session_state.filters_applied:
                 else:
                     st.info("No hay datos de país disponibles")
             
-            # TAB 6: CORRELACIONES
-            with result_tabs[5]:
+            # TAB 7: CORRELACIONES
+            @st.fragment
+            def render_correlation_panel(filtered_df):
                 st.markdown("### 📐 Análisis de Correlaciones")
                 
                 # Seleccionar métricas numéricas clave
@@ -4861,7 +5595,9 @@ if st.session_state.filters_applied:
                 
                 if len(available_numeric) > 2:
                     # Calcular correlaciones
-                    corr_matrix = filtered_df[available_numeric].corr()
+                    corr_matrix = get_correlation_matrix(
+                        filter_fingerprint(active_filters), get_dataset_version(df), available_numeric, filtered_df
+                    )
                     
                     # Heatmap de correlaciones
                     fig = px.imshow(
@@ -4908,8 +5644,9 @@ if st.session_state.filters_applied:
                 else:
                     st.info("No hay suficientes métricas numéricas para análisis de correlación")
             
-            # TAB 7: EXPORTAR - SIMPLIFIED VERSION
-            with result_tabs[6]:
+            # TAB 8: EXPORTAR - SIMPLIFIED VERSION
+            @st.fragment
+            def render_export_panel(filtered_df):
                 st.markdown("### 💾 Opciones de Exportación")
                 
                 col1, col2 = st.columns(2)
@@ -4929,6 +5666,10 @@ if st.session_state.filters_applied:
                     export_columns = st.multiselect(
                         "Seleccionar columnas para exportar (dejar vacío para todas):",
                         options=list(filtered_df.columns),
+                        default=saved_selection("export_columns", [], list(filtered_df.columns)),
+                        key="export_columns",
+                        on_change=remember_selection,
+                        args=("export_columns",),
                         help="Si no seleccionas ninguna, se exportarán todas las columnas"
                     )
                 
@@ -4940,35 +5681,26 @@ if st.session_state.filters_applied:
                 
                 col1, col2, col3, col4 = st.columns(4)
                 
-                # CSV Download - Direct generation without caching
+                # Los ficheros se generan al pulsar cada botón (data como callable) y se cachean
+                fingerprint = filter_fingerprint(active_filters)
+                data_version = get_dataset_version(df)
+                columns_key = tuple(export_df.columns)
+                
+                # CSV Download
                 with col1:
-                    csv = export_df.to_csv(index=False)
                     st.download_button(
                         label="📄 Descargar CSV",
-                        data=csv,
+                        data=lambda: build_export(fingerprint, data_version, columns_key, 'csv', export_df),
                         file_name=f"bquant_{timestamp}.csv",
                         mime="text/csv",
                         use_container_width=True
                     )
                 
-                # Excel Download - Using BytesIO properly
+                # Excel Download
                 with col2:
-                    buffer = io.BytesIO()
-                    with pd.ExcelWriter(buffer, engine='xlsxwriter') as writer:
-                        export_df.to_excel(writer, sheet_name='Resultados', index=False)
-                        # Add summary sheet
-                        pd.DataFrame({
-                            'Métrica': ['Total', 'Países', 'Sectores'],
-                            'Valor': [
-                                len(export_df),
-                                export_df['Country'].nunique() if 'Country' in export_df.columns else 0,
-                                export_df['Sector'].nunique() if 'Sector' in export_df.columns else 0
-                            ]
-                        }).to_excel(writer, sheet_name='Resumen', index=False)
-                    
                     st.download_button(
                         label="📊 Descargar Excel",
-                        data=buffer.getvalue(),
+                        data=lambda: build_export(fingerprint, data_version, columns_key, 'xlsx', export_df),
                         file_name=f"bquant_{timestamp}.xlsx",
                         mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
                         use_container_width=True
@@ -4976,10 +5708,9 @@ if st.session_state.filters_applied:
                 
                 # JSON Download
                 with col3:
-                    json_str = export_df.to_json(orient='records', indent=2)
                     st.download_button(
                         label="📋 Descargar JSON",
-                        data=json_str,
+                        data=lambda: build_export(fingerprint, data_version, columns_key, 'json', export_df),
                         file_name=f"bquant_{timestamp}.json",
                         mime="application/json",
                         use_container_width=True
@@ -5002,23 +5733,60 @@ if st.session_state.filters_applied:
                         mime="text/plain",
                         use_container_width=True
                     )
+                
+                # Formatos columnares tipados (Parquet y Arrow IPC / Feather)
+                st.markdown("##### 🗄️ Formatos Columnares")
+                col1, col2 = st.columns(2)
+                with col1:
+                    st.download_button(
+                        label="🧱 Descargar Parquet",
+                        data=lambda: build_export(fingerprint, data_version, columns_key, 'parquet', export_df),
+                        file_name=f"bquant_{timestamp}.parquet",
+                        mime="application/vnd.apache.parquet",
+                        use_container_width=True,
+                        help="Columnar comprimido (zstd); conserva fechas, categorías y scores"
+                    )
+                with col2:
+                    st.download_button(
+                        label="🏹 Descargar Arrow / Feather",
+                        data=lambda: build_export(fingerprint, data_version, columns_key, 'feather', export_df),
+                        file_name=f"bquant_{timestamp}.feather",
+                        mime="application/vnd.apache.arrow.file",
+                        use_container_width=True,
+                        help="Arrow IPC comprimido (zstd); lectura casi instantánea con pandas.read_feather"
+                    )
+        
+            result_panels = {
+                "📊 Tabla": render_table_panel,
+                "🎯 Casi Cumplen": render_near_miss_panel,
+                "📈 Gráficos": render_charts_panel,
+                "🏆 Rankings": render_rankings_panel,
+                "🎯 Análisis Sectorial": render_sector_panel,
+                "🌍 Análisis por País": render_country_panel,
+                "📐 Correlaciones": render_correlation_panel,
+                "💾 Exportar": render_export_panel,
+            }
+            result_panels[selected_panel](filtered_df)
         
         elif st.session_state.filters_applied and filtered_df.empty:
             # No results found
             st.warning("⚠️ No se encontraron acciones que cumplan todos los criterios.")
+            render_filter_funnel(df, active_filters)
+            st.markdown("#### 🎯 Acciones que Casi Cumplen")
+            render_near_misses(df, active_filters, "empty")
             
             # Provide helpful suggestions based on country selection
             if 'countries_filter' in st.session_state and st.session_state.countries_filter:
                 selected_countries = st.session_state.countries_filter
                 
                 # Check if selected countries have poor data coverage
-                country_df = df[df['Country'].isin(selected_countries)]
+                selected_coverage = get_coverage(coverage_cube, selected_countries)
                 sample_metrics = ['PE Ratio', 'ROE', 'Rev. Growth']
                 coverage_check = {}
                 
                 for metric in sample_metrics:
-                    if metric in country_df.columns:
-                        coverage_check[metric] = (country_df[metric].notna().sum() / len(country_df)) * 100
+                    if metric in selected_coverage.index:
+                        coverage_check[metric] = selected_coverage[metric] * 100
                 
                 avg_country_coverage = sum(coverage_check.values()) / len(coverage_check) if coverage_check else 0
                 